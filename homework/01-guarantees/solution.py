@@ -1,20 +1,37 @@
+import abc
+import heapq
+
 from dslabmp import Context, Message, Process
-from queue import Queue
 
 
-# AT MOST ONCE ---------------------------------------------------------------------------------------------------------
+# BATCHING -------------------------------------------------------------------------------------------------------------
+
+class BatchingSender(Process):
+    """
+    Sends messages from local user to the receiver in frames, a frame gets the next id.
+    With BATCH_SIZE above one, messages are collected until there are BATCH_SIZE of them or BATCH_DELAY has passed
+    since the first one, and the whole batch is sent as one frame, unpacked by the receiver in order.
+    Guarantees apply to frames, so every message of a batch gets the same guarantee as the batch.
+    """
+    BATCH_SIZE = 1
+    BATCH_DELAY = 0.01
 
-class AtMostOnceSender(Process):
     def __init__(self, proc_id: str, receiver_id: str):
         self._id = proc_id
         self._receiver = receiver_id
         self._index = 0
+        self._batch = []  # messages waiting to be sent, empty unless batching is enabled
 
     def on_local_message(self, msg: Message, ctx: Context):
         # receive message for delivery from local user
-        msg['id'] = self._index
-        self._index += 1
-        ctx.send(msg, self._receiver)
+        if self.BATCH_SIZE == 1:
+            self._send_next_frame([msg], ctx)
+            return
+        self._batch.append(msg)
+        if len(self._batch) >= self.BATCH_SIZE:
+            self._flush_batch(ctx)
+        elif len(self._batch) == 1:
+            ctx.set_timer_once('batch', self.BATCH_DELAY)
 
     def on_message(self, msg: Message, sender: str, ctx: Context):
         # process messages from receiver here
@@ -22,14 +39,184 @@ class AtMostOnceSender(Process):
 
     def on_timer(self, timer_name: str, ctx: Context):
         # process fired timers here
-        pass
+        if timer_name == 'batch':
+            self._flush_batch(ctx)
+
+    def _flush_batch(self, ctx: Context):
+        ctx.cancel_timer('batch')
+        batch = self._batch
+        if batch:
+            self._batch = []
+            self._send_next_frame(batch, ctx)
+
+    def _send_next_frame(self, messages, ctx: Context):
+        index = self._index
+        self._index += 1
+        self._send_frame(index, make_frame(index, messages), ctx)
+
+    @abc.abstractmethod
+    def _send_frame(self, index: int, frame: Message, ctx: Context):
+        """
+        Sends the frame built by make_frame().
+        """
+
+
+def make_frame(index: int, messages) -> Message:
+    """
+    Builds the frame with the given id: a single message is sent itself with the id added,
+    and a batch is sent as BATCH message with the types and payloads of its messages.
+    """
+    # a single BATCH message from local user is wrapped too, so that it is not taken for a frame of a batch
+    if len(messages) == 1 and messages[0].type != 'BATCH':
+        frame = messages[0]
+        frame['id'] = index
+        return frame
+    return Message('BATCH', {'id': index, 'messages': [[msg.type, msg.encode()] for msg in messages]})
+
+
+def deliver_frame(frame: Message, ctx: Context):
+    """
+    Delivers the message of a frame to local user, or all messages of a batch in order.
+    """
+    if frame.type == 'BATCH':
+        for message_type, payload in frame['messages']:
+            ctx.send_local(Message.decode(message_type, payload))
+    else:
+        frame.remove('id')
+        ctx.send_local(frame)
+
+
+# RETRANSMISSIONS ------------------------------------------------------------------------------------------------------
+
+class RetransmittingSender(BatchingSender):
+    """
+    Keeps frames until they are acknowledged and retransmits them on their deadlines.
+    At most WINDOW_SIZE oldest not acknowledged frames are sent.
+
+    Retransmission timeout is estimated from round-trip times as in TCP (Jacobson/Karels, RFC 6298),
+    and every next retransmission of a message waits BACKOFF times longer (exponential backoff).
+    The estimator is kept in plain attributes, since process state has to be picklable by the runtime.
+    """
+    WINDOW_SIZE = 32  # None for no limit
+    BACKOFF = 2
+
+    INITIAL_RTO = 5
+    MIN_RTO = 1
+    MAX_RTO = 60
+    # lower bound of the variation term, so that the timeout is not equal to a stable round-trip time
+    MIN_VARIATION = 1
+
+    def __init__(self, proc_id: str, receiver_id: str):
+        super().__init__(proc_id, receiver_id)
+        self._need_send = dict()  # {id: (frame, last send time, number of sends)}, in the order of ids
+        self._next_send = 0  # frames with smaller ids are sent at least once
+        # heap of (deadline, id, number of sends), an entry is stale once its frame is acknowledged or resent
+        self._deadlines = []
+        self._srtt = None
+        self._rttvar = None
+        self._rto = self.INITIAL_RTO
+
+    def on_timer(self, timer_name: str, ctx: Context):
+        # process fired timers here
+        if timer_name in {'resend'}:
+            now = ctx.time()
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, index, sends = heapq.heappop(self._deadlines)
+                if not self._is_pending(index, sends):
+                    continue
+                # the timeout estimate could grow since the frame was sent
+                deadline = self._deadline(self._need_send[index][1], sends)
+                if deadline > now:
+                    heapq.heappush(self._deadlines, (deadline, index, sends))
+                else:
+                    self._send(index, ctx)
+            self._set_resend_timer(ctx)
+        else:
+            super().on_timer(timer_name, ctx)
+
+    def _send_frame(self, index: int, frame: Message, ctx: Context):
+        self._need_send[index] = (frame, 0., 0)
+        self._send_window(ctx)
+
+    def _acknowledge(self, indexes, ctx: Context):
+        # forgets acknowledged messages, the last sent one which was not retransmitted gives a round-trip sample
+        now = ctx.time()
+        sample_sent_at = None
+        for index in indexes:
+            entry = self._need_send.pop(index, None)
+            if entry is not None and entry[2] == 1 and (sample_sent_at is None or entry[1] > sample_sent_at):
+                sample_sent_at = entry[1]
+        if sample_sent_at is not None:
+            self._on_rtt_sample(now - sample_sent_at)
+        self._send_window(ctx)
+
+    def _on_rtt_sample(self, rtt: float):
+        if self._srtt is None:
+            self._srtt = rtt
+            self._rttvar = rtt / 2
+        else:
+            self._rttvar = 0.75 * self._rttvar + 0.25 * abs(self._srtt - rtt)
+            self._srtt = 0.875 * self._srtt + 0.125 * rtt
+        rto = self._srtt + max(self.MIN_VARIATION, 4 * self._rttvar)
+        self._rto = min(max(rto, self.MIN_RTO), self.MAX_RTO)
+
+    def _deadline(self, sent_at: float, sends: int) -> float:
+        return sent_at + min(self._rto * self.BACKOFF ** (sends - 1), self.MAX_RTO)
+
+    def _send_window(self, ctx: Context):
+        # frames are sent for the first time in the order of ids, as long as the window has room for them
+        while self._next_send < self._index and self._fits_window(self._next_send):
+            self._send(self._next_send, ctx)
+            self._next_send += 1
+        self._set_resend_timer(ctx)
+
+    def _fits_window(self, index: int) -> bool:
+        # frames with smaller ids which are not acknowledged yet are in flight
+        return self.WINDOW_SIZE is None or len(self._need_send) - (self._index - index) < self.WINDOW_SIZE
+
+    def _is_pending(self, index: int, sends: int) -> bool:
+        entry = self._need_send.get(index)
+        return entry is not None and entry[2] == sends
+
+    def _send(self, index: int, ctx: Context):
+        frame, _, sends = self._need_send[index]
+        now = ctx.time()
+        self._need_send[index] = (frame, now, sends + 1)
+        heapq.heappush(self._deadlines, (self._deadline(now, sends + 1), index, sends + 1))
+        ctx.send(frame, self._receiver)
+
+    def _set_resend_timer(self, ctx: Context):
+        while self._deadlines and not self._is_pending(*self._deadlines[0][1:]):
+            heapq.heappop(self._deadlines)
+        if self._deadlines:
+            ctx.set_timer('resend', max(0., self._deadlines[0][0] - ctx.time()))
+        else:
+            ctx.cancel_timer('resend')
+
+
+# AT MOST ONCE ---------------------------------------------------------------------------------------------------------
+
+class AtMostOnceSender(BatchingSender):
+    def _send_frame(self, index: int, frame: Message, ctx: Context):
+        ctx.send(frame, self._receiver)
 
 
 class AtMostOnceReceiver(Process):
+    """
+    Detects duplicates by the lowest id not received from each sender and a bitmap of the received ids above it,
+    so ids are tracked exactly however far messages are reordered. The bitmap spans at most DEDUP_WINDOW ids:
+    if the highest received id gets further than that, the oldest missing ids are given up as lost,
+    and a message arriving after more than DEDUP_WINDOW later ones would be dropped rather than delivered twice.
+    With DEDUP_EXPIRY set, senders silent for that long are forgotten,
+    assuming that by then the network holds no duplicates of their messages.
+    """
+    DEDUP_WINDOW = 1 << 16
+    DEDUP_EXPIRY = None
 
     def __init__(self, proc_id: str):
         self._id = proc_id
-        self._queue = []
+        # {sender: (lowest id not received, bit i is set if id lowest + i is received, time of the last message)}
+        self._received = dict()
 
     def on_local_message(self, msg: Message, ctx: Context):
         # not used in this task
@@ -39,64 +226,58 @@ class AtMostOnceReceiver(Process):
         # process messages from receiver
         # deliver message to local user with ctx.send_local()
         received_index = msg['id']
-        msg.remove('id')
-
-        for index in self._queue:
-            if index == received_index:
-                return
-
-        if len(self._queue) >= 15:
-            self._queue.pop(0)
-        self._queue.append(received_index)
+        low, bits, _ = self._received.get(sender, (0, 0, 0.))
 
-        ctx.send_local(msg)
+        offset = received_index - low
+        if offset < 0 or bits >> offset & 1:
+            return
+        bits |= 1 << offset
+        if offset >= self.DEDUP_WINDOW:
+            # the oldest ids are given up, so the bitmap does not grow beyond the window
+            shift = offset + 1 - self.DEDUP_WINDOW
+            bits >>= shift
+            low += shift
+        # move the bitmap over the received prefix
+        received_prefix = (bits ^ (bits + 1)).bit_length() - 1
+        self._received[sender] = (low + received_prefix, bits >> received_prefix, ctx.time())
+        if self.DEDUP_EXPIRY is not None:
+            ctx.set_timer_once('expire', self.DEDUP_EXPIRY)
+
+        deliver_frame(msg, ctx)
 
     def on_timer(self, timer_name: str, ctx: Context):
         # process fired timers here
-        pass
+        if timer_name == 'expire':
+            now = ctx.time()
+            for sender, (_, _, last_time) in list(self._received.items()):
+                if now - last_time >= self.DEDUP_EXPIRY:
+                    del self._received[sender]
+            if self._received:
+                ctx.set_timer_once('expire', self.DEDUP_EXPIRY)
 
 
 # AT LEAST ONCE --------------------------------------------------------------------------------------------------------
 
-class AtLeastOnceSender(Process):
-    def __init__(self, proc_id: str, receiver_id: str):
-        self._id = proc_id
-        self._receiver = receiver_id
-        self._need_send = dict()  # {id: msg}
-        self._index = 1
-
-    def on_local_message(self, msg: Message, ctx: Context):
-        # receive message for delivery from local user\
-
-        self._need_send[self._index] = msg
-        msg['id'] = self._index
-
-        self._index += 1
-
-        if len(self._need_send) == 1:
-            ctx.set_timer('resend', 5)
+class AtLeastOnceSender(RetransmittingSender):
+    WINDOW_SIZE = None
+    BACKOFF = 1
 
     def on_message(self, msg: Message, sender: str, ctx: Context):
         # process messages from receiver here
-        if msg['id'] in self._need_send:
-            self._need_send.pop(msg['id'])
-        if len(self._need_send) == 0:
-            ctx.cancel_timer('resend')
-
-    def on_timer(self, timer_name: str, ctx: Context):
-        # process fired timers here
-        if timer_name in {'resend'}:
-            for index in self._need_send.keys():
-                msg = self._need_send[index]
-                msg['id'] = index
-                ctx.send(msg, self._receiver)
-            if len(self._need_send) != 0:
-                ctx.set_timer('resend', 5)
+        self._acknowledge(msg['ids'], ctx)
 
 
 class AtLeastOnceReceiver(Process):
+    """
+    Acknowledgements are batched as in ExactlyOnceReceiver: ids of received messages are collected
+    and sent in one ack once there are ACK_BATCH_SIZE of them or ACK_DELAY after the first one.
+    """
+    ACK_BATCH_SIZE = 8
+    ACK_DELAY = 0.5
+
     def __init__(self, proc_id: str):
         self._id = proc_id
+        self._unacknowledged = dict()  # {sender: ids of received messages not acknowledged yet}
 
     def on_local_message(self, msg: Message, ctx: Context):
         # not used in this task
@@ -106,62 +287,61 @@ class AtLeastOnceReceiver(Process):
         # process messages from receiver
         # deliver message to local user with ctx.send_local()
         index = msg['id']
-        msg.remove('id')
-        ctx.send_local(msg)
+        deliver_frame(msg, ctx)
 
-        ctx.send(Message('', {'id': index}), sender)
+        indexes = self._unacknowledged.setdefault(sender, [])
+        indexes.append(index)
+        if len(indexes) >= self.ACK_BATCH_SIZE:
+            self._send_ack(sender, ctx)
+        elif len(indexes) == 1:
+            ctx.set_timer_once('ack ' + sender, self.ACK_DELAY)
 
     def on_timer(self, timer_name: str, ctx: Context):
         # process fired timers here
-        pass
-
-
-# EXACTLY ONCE ---------------------------------------------------------------------------------------------------------
-
-class ExactlyOnceSender(Process):
-    def __init__(self, proc_id: str, receiver_id: str):
-        self._id = proc_id
-        self._receiver = receiver_id
-        self._need_send = list()  # {id: msg}
-        self._index = 0
-
-    def on_local_message(self, msg: Message, ctx: Context):
-        # receive message for delivery from local user\
+        if timer_name.startswith('ack '):
+            self._send_ack(timer_name[len('ack '):], ctx)
 
-        msg['id'] = self._index
-        self._need_send.append(msg)
+    def _send_ack(self, sender: str, ctx: Context):
+        ctx.cancel_timer('ack ' + sender)
+        ctx.send(Message('', {'ids': self._unacknowledged.pop(sender)}), sender)
 
-        self._index += 1
 
-        if len(self._need_send) == 1:
-            ctx.set_timer('resend', 5)
+# EXACTLY ONCE ---------------------------------------------------------------------------------------------------------
 
+class ExactlyOnceSender(RetransmittingSender):
     def on_message(self, msg: Message, sender: str, ctx: Context):
         # process messages from receiver here
-        for i, value in enumerate(self._need_send):
-            if value['id'] == msg['id']:
-                self._need_send.pop(i)
+        # ack: all ids below are received, sack: bit i is set if id ack + i is received
+        ack = msg['ack']
+        acknowledged = []
+        for index in self._need_send:
+            if index >= ack:
                 break
-        if len(self._need_send) == 0:
-            ctx.cancel_timer('resend')
+            acknowledged.append(index)
 
-    def on_timer(self, timer_name: str, ctx: Context):
-        # process fired timers here
-        send_buffer_size = 2
+        selective = msg['sack']
+        while selective:
+            lowest = selective & -selective
+            acknowledged.append(ack + lowest.bit_length() - 1)
+            selective ^= lowest
 
-        if timer_name in {'resend'}:
-            for i, msg in enumerate(self._need_send):
-                if i >= send_buffer_size:
-                    break
-                ctx.send(msg, self._receiver)
-            if len(self._need_send) > 0:
-                ctx.set_timer('resend', 5)
+        self._acknowledge(acknowledged, ctx)
 
 
 class ExactlyOnceReceiver(Process):
+    """
+    Acknowledgements are batched: the cumulative and selective ack covers all messages received so far,
+    so it is sent once per ACK_BATCH_SIZE new messages or ACK_DELAY after the first not acknowledged one.
+    Duplicates are acknowledged at once, since they mean that the sender has not got the previous ack.
+    """
+    ACK_BATCH_SIZE = 8
+    ACK_DELAY = 0.5
+
     def __init__(self, proc_id: str):
         self._id = proc_id
-        self._queue = []
+        self._expected = 0  # all messages with smaller ids are delivered
+        self._received = 0  # bit i is set if message with id expected + i is delivered
+        self._unacknowledged = 0  # number of delivered messages not covered by the last sent ack
 
     def on_local_message(self, msg: Message, ctx: Context):
         # not used in this task
@@ -171,73 +351,63 @@ class ExactlyOnceReceiver(Process):
         # process messages from receiver
         # deliver message to local user with ctx.send_local()
         received_index = msg['id']
-        msg.remove('id')
-
-        ctx.send(Message('', {'id': received_index}), sender)
 
-        for i, index in enumerate(self._queue):
-            if index == received_index:
-                self._queue.pop(i)
-                self._queue.append(index)
-                return
+        offset = received_index - self._expected
+        if offset < 0 or self._received >> offset & 1:
+            self._send_ack(sender, ctx)
+            return
 
-        if len(self._queue) >= 16:
-            self._queue.pop(0)
-        self._queue.append(received_index)
+        self._received |= 1 << offset
+        deliver_frame(msg, ctx)
+        # move the window over the delivered prefix
+        while self._received & 1:
+            self._received >>= 1
+            self._expected += 1
 
-        ctx.send_local(msg)
+        self._unacknowledged += 1
+        if self._unacknowledged >= self.ACK_BATCH_SIZE:
+            self._send_ack(sender, ctx)
+        elif self._unacknowledged == 1:
+            ctx.set_timer_once('ack ' + sender, self.ACK_DELAY)
 
     def on_timer(self, timer_name: str, ctx: Context):
         # process fired timers here
-        pass
+        if timer_name.startswith('ack '):
+            self._send_ack(timer_name[len('ack '):], ctx)
 
+    def _send_ack(self, sender: str, ctx: Context):
+        if self._unacknowledged:
+            self._unacknowledged = 0
+            ctx.cancel_timer('ack ' + sender)
+        ctx.send(Message('', {'ack': self._expected, 'sack': self._received}), sender)
 
-# EXACTLY ONCE + ORDERED -----------------------------------------------------------------------------------------------
 
-class ExactlyOnceOrderedSender(Process):
-    def __init__(self, proc_id: str, receiver_id: str):
-        self._id = proc_id
-        self._receiver = receiver_id
-        self._need_send = list()  # {id: msg}
-        self._index = 0
+# EXACTLY ONCE + ORDERED -----------------------------------------------------------------------------------------------
 
-    def on_local_message(self, msg: Message, ctx: Context):
-        # receive message for delivery from local user\
+# messages arriving ahead of order that the receiver can keep until their turn
+REORDER_BUFFER_SIZE = 16
 
-        msg['id'] = self._index
-        self._need_send.append(msg)
 
-        self._index += 1
+class ExactlyOnceOrderedSender(RetransmittingSender):
+    """
+    Only ids less than WINDOW_SIZE after the oldest not acknowledged frame are sent, so they always fit
+    the receiver buffer: frames beyond it would be dropped, so there is no point in sending them.
+    """
+    WINDOW_SIZE = REORDER_BUFFER_SIZE
 
-        if len(self._need_send) == 1:
-            ctx.set_timer('resend', 8)
+    def _fits_window(self, index: int) -> bool:
+        return index < next(iter(self._need_send)) + self.WINDOW_SIZE
 
     def on_message(self, msg: Message, sender: str, ctx: Context):
         # process messages from receiver here
-        for i, value in enumerate(self._need_send):
-            if value['id'] == msg['id']:
-                self._need_send.pop(i)
-                break
-        if len(self._need_send) == 0:
-            ctx.cancel_timer('resend')
-
-    def on_timer(self, timer_name: str, ctx: Context):
-        # process fired timers here
-        send_buffer_size = 2
-
-        if timer_name in {'resend'}:
-            for i, msg in enumerate(self._need_send):
-                if i >= send_buffer_size:
-                    break
-                ctx.send(msg, self._receiver)
-            if len(self._need_send) > 0:
-                ctx.set_timer('resend', 8)
+        self._acknowledge([msg['id']], ctx)
 
 
 class ExactlyOnceOrderedReceiver(Process):
     def __init__(self, proc_id: str):
         self._id = proc_id
         self._need_send_index = 0
+        self._buffer = dict()  # {id: frame}, received ahead of order
 
     def on_local_message(self, msg: Message, ctx: Context):
         # not used in this task
@@ -247,17 +417,22 @@ class ExactlyOnceOrderedReceiver(Process):
         # process messages from receiver
         # deliver message to local user with ctx.send_local()
         received_index = msg['id']
-        msg.remove('id')
 
-        if received_index <= self._need_send_index:
-            ctx.send(Message('', {'id': received_index}), sender)
-        else:
+        if received_index >= self._need_send_index + REORDER_BUFFER_SIZE:
+            # no room in the buffer, the sender will retransmit it
             return
+        ctx.send(Message('', {'id': received_index}), sender)
 
-        if received_index == self._need_send_index:
-            ctx.send_local(msg)
+        if received_index > self._need_send_index:
+            self._buffer[received_index] = msg
+        elif received_index == self._need_send_index:
+            deliver_frame(msg, ctx)
             self._need_send_index += 1
+            # deliver the contiguous run of buffered messages
+            while self._need_send_index in self._buffer:
+                deliver_frame(self._buffer.pop(self._need_send_index), ctx)
+                self._need_send_index += 1
 
     def on_timer(self, timer_name: str, ctx: Context):
         # process fired timers here
-        pass
\ No newline at end of file
+        pass
@@ -102,6 +102,7 @@ fn main() {
             test_delayed_duplicated,
             config,
         );
+        tests.add("[AT MOST ONCE] REORDERED", test_reordered, config);
         // with drops is not reliable
         config.reliable = false;
         tests.add("[AT MOST ONCE] DROPPED", test_dropped, config);
@@ -368,6 +369,15 @@ fn test_delayed_duplicated(config: &TestConfig) -> TestResult {
     check_guarantees(&mut sys, &messages, config)
 }
 
+fn test_reordered(config: &TestConfig) -> TestResult {
+    let mut sys = build_system(config, false);
+    // messages of a long burst overtake each other by hundreds of ids
+    sys.network().set_delays(0.1, 3.);
+    let messages = send_messages(&mut sys, 1000);
+    sys.step_until_no_events();
+    check_guarantees(&mut sys, &messages, config)
+}
+
 fn test_dropped(config: &TestConfig) -> TestResult {
     let mut sys = build_system(config, false);
     sys.network().set_drop_rate(0.3);
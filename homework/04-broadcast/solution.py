@@ -1,88 +1,184 @@
+import random
+
 from dslabmp import Context, Message, Process
 from typing import List
 
 
 # TODO maybe if we are not a sender, and we got bcast we can deliver it without count checking
 class BroadcastProcess(Process):
+    # with GOSSIP_FANOUT set, messages are spread in gossip rounds instead of being relayed to all processes
+    GOSSIP_FANOUT = None
+    GOSSIP_INTERVAL = 1
+
     def __init__(self, proc_id: str, processes: List[str]):
         self._id = proc_id
         self._processes = processes
         self._counter = 0
 
-        self._messages_broadcasted = set()  # ids
-        self._received_messages_ids = set()  # got from local user
-        self._delivered_messages_ids = set()  # sent to local user
-        self._messages_want_deliver = {}  # ids -> [approves_count, message]
+        # messages of every sender are delivered in the order of sending, so only their number is kept,
+        # and nothing else is kept for delivered messages: their later copies are recognized by this number
+        self._delivered = {}  # sender -> count of delivered messages
+        self._messages_want_deliver = {}  # ids -> [approves_count, missing_dependencies_count, message]
+        self._waiting = {}  # (sender, count) -> ids of messages waiting for count messages of sender
+
+        # gossip mode: holders are bitmasks over the sorted process ids, the same at all processes
+        self._bits = {proc: 1 << index for index, proc in enumerate(sorted(processes))}
+        self._holders = {}  # ids -> bitmask of processes known to have the message
+        self._spreading = {}  # ids -> [message, processes left to gossip the message to, in random order]
 
     def on_local_message(self, msg: Message, ctx: Context):
         if msg.type == 'SEND':
             message_id = str(self._counter) + '_' + str(self._id)
+
+            # vector clock: the message depends on clock[sender] first messages of every sender,
+            # including all previous messages of this process, delivered or not
+            clock = dict(self._delivered)
+            clock[self._id] = self._counter
             self._counter += 1
 
             bcast_msg = Message('BCAST', {
                 'text': msg['text'],
-                'ids_need_before': list(self._received_messages_ids | self._delivered_messages_ids),
+                'sender': self._id,
+                'clock': clock,
                 'id': message_id
             })
-            for proc in self._processes:
-                if proc == self._id:
-                    continue
-                ctx.send(bcast_msg, proc)
-            self._received_messages_ids.add(message_id)
-
-            self._messages_broadcasted.add(message_id)
-
-            self._messages_want_deliver[message_id] = [0, bcast_msg]
-
-    def try_deliver_messages(self, ctx):
-        messages_sent = 0
-
-        for message_id in list(self._messages_want_deliver.keys()):
-            pair = self._messages_want_deliver[message_id]
-            approves_count, message = pair[0], pair[1]
-
-            if approves_count < len(self._processes) // 2:
-                continue
-
-            if not set(message['ids_need_before']).issubset(self._delivered_messages_ids):
-                continue
+            if self.GOSSIP_FANOUT is not None:
+                self._holders[message_id] = self._bits[self._id]
+                self._spread(message_id, bcast_msg, ctx)
+            else:
+                ctx.send_many(bcast_msg, (proc for proc in self._processes if proc != self._id))
+
+            self._want_deliver(message_id, bcast_msg, 0, ctx)
+
+    def _want_deliver(self, message_id: str, message: Message, approves_count: int, ctx: Context):
+        missing = 0
+        for sender, count in message.peek('clock').items():
+            if self._delivered.get(sender, 0) < count:
+                self._waiting.setdefault((sender, count), []).append(message_id)
+                missing += 1
+        self._messages_want_deliver[message_id] = [approves_count, missing, message]
+        if approves_count >= len(self._processes) // 2 and not missing:
+            self.try_deliver_messages([message_id], ctx)
+
+    def _approve(self, message_id: str, approves_count: int, ctx: Context):
+        pair = self._messages_want_deliver.get(message_id)
+        if pair is None:
+            return
+        quorum = len(self._processes) // 2
+        # the message becomes ready once, when it gets enough approves or the last missing dependency
+        ready = pair[0] < quorum <= approves_count and not pair[1]
+        pair[0] = approves_count
+        if ready:
+            self.try_deliver_messages([message_id], ctx)
+
+    def try_deliver_messages(self, ready: List[str], ctx: Context):
+        """
+        Delivers the ready messages, which have enough approves and no missing dependencies,
+        and then the messages which become ready after them.
+        """
+        while ready:
+            message_id = ready.pop()
+            message = self._messages_want_deliver.pop(message_id)[2]
             deliver_msg = Message('DELIVER', {
                 'text': message['text']
             })
             ctx.send_local(deliver_msg)
-            messages_sent += 1
 
-            del self._messages_want_deliver[message_id]
-            self._delivered_messages_ids.add(message_id)
+            sender = message['sender']
+            self._delivered[sender] = self._delivered.get(sender, 0) + 1
+            self._forget_if_done(message_id, message)
+            for waiting_id in self._waiting.pop((sender, self._delivered[sender]), ()):
+                pair = self._messages_want_deliver[waiting_id]
+                pair[1] -= 1
+                if not pair[1] and pair[0] >= len(self._processes) // 2:
+                    ready.append(waiting_id)
 
-        return messages_sent > 0
+    def _is_delivered(self, message: Message) -> bool:
+        # the clock is only read, so that a received message is still relayed with its original payload
+        return message.peek('clock')[message['sender']] < self._delivered.get(message['sender'], 0)
 
     def on_message(self, msg: Message, sender: str, ctx: Context):
         message_id = msg['id']
 
         if msg.type == 'BCAST':
-            if message_id in self._delivered_messages_ids:
+            if self._is_delivered(msg):
                 return
 
-            if message_id in self._messages_want_deliver:
-                self._messages_want_deliver[message_id] = [
-                    self._messages_want_deliver[message_id][0] + 1,
-                    self._messages_want_deliver[message_id][1]
-                ]
+            # the first copy of a message, messages of this process are added on sending
+            if message_id not in self._messages_want_deliver:
+                ctx.send_many(msg, (proc for proc in self._processes if proc != self._id))
+                self._want_deliver(message_id, msg, 1, ctx)
             else:
-                self._messages_want_deliver[message_id] = [1, msg]
+                self._approve(message_id, self._messages_want_deliver[message_id][0] + 1, ctx)
 
-            if message_id not in self._messages_broadcasted:
-                for proc in self._processes:
-                    if proc == self._id:
-                        continue
-                    ctx.send(msg, proc)
-                self._messages_broadcasted.add(message_id)
+        elif msg.type == 'GOSSIP':
+            known = message_id in self._holders
+            if not known and self._is_delivered(msg):
+                # the message is delivered and forgotten, the sender only has to learn that it is held here
+                ctx.send(Message('GOSSIP_ACK', {'id': message_id, 'holders': self._bits[self._id]}), sender)
+                return
+            holders = self._holders.get(message_id, 0) | msg['holders'] | self._bits[sender] | self._bits[self._id]
+            self._holders[message_id] = holders
+            approves_count = bin(holders).count('1') - 1
+            if known:
+                self._approve(message_id, approves_count, ctx)
+            else:
+                self._spread(message_id, msg, ctx)
+                self._want_deliver(message_id, msg, approves_count, ctx)
+            # pull: the sender learns the holders known here, including this process
+            ctx.send(Message('GOSSIP_ACK', {'id': message_id, 'holders': holders}), sender)
 
-            while True:
-                sent = self.try_deliver_messages(ctx)
-                if not sent:
-                    break
+        elif msg.type == 'GOSSIP_ACK':
+            if message_id not in self._holders:
+                return
+            holders = self._holders[message_id] | msg['holders']
+            self._holders[message_id] = holders
+            self._approve(message_id, bin(holders).count('1') - 1, ctx)
 
     def on_timer(self, timer_name: str, ctx: Context):
-        pass
+        if timer_name == 'gossip':
+            for message_id in list(self._spreading):
+                self._gossip_round(message_id, ctx)
+            if self._spreading:
+                ctx.set_timer('gossip', self.GOSSIP_INTERVAL)
+
+    # GOSSIP -----------------------------------------------------------------------------------------------------------
+
+    def _spread(self, message_id: str, message: Message, ctx: Context):
+        """
+        Starts gossiping the message: every round it is pushed to GOSSIP_FANOUT processes, which are not known
+        to have it, until every process either is known to have it or has been sent it.
+        Holders are confirmed by GOSSIP_ACK, and a message is approved by holders instead of relayed copies,
+        so uniform agreement still relies on a majority having the message before it is delivered.
+        """
+        peers = [proc for proc in self._processes if not self._holders[message_id] & self._bits[proc]]
+        random.shuffle(peers)
+        self._spreading[message_id] = [message, peers]
+        self._gossip_round(message_id, ctx)
+        if self._spreading:
+            ctx.set_timer_once('gossip', self.GOSSIP_INTERVAL)
+
+    def _gossip_round(self, message_id: str, ctx: Context):
+        message, peers = self._spreading[message_id]
+        holders = self._holders[message_id]
+        targets = []
+        while peers and len(targets) < self.GOSSIP_FANOUT:
+            peer = peers.pop()
+            if not holders & self._bits[peer]:
+                targets.append(peer)
+        if targets:
+            ctx.send_many(Message('GOSSIP', {
+                'text': message['text'],
+                'sender': message['sender'],
+                'clock': message.peek('clock'),
+                'id': message_id,
+                'holders': holders
+            }), targets)
+        if not peers:
+            del self._spreading[message_id]
+            self._forget_if_done(message_id, message)
+
+    def _forget_if_done(self, message_id: str, message: Message):
+        # holders of a delivered message are not needed once it is not spread any more
+        if message_id not in self._spreading and self._is_delivered(message):
+            self._holders.pop(message_id, None)
@@ -1,33 +1,76 @@
 from dslabmp import Context, Message, Process
+import base64
+import collections
+import itertools
+import json
+import math
 import random
+import zlib
 
 JOIN = 'JOIN'
 
 ACK = 'ACK'
 PING = 'PING'
 PING_REQ = 'PING_REQ'
+SYNC_DIGEST = 'SYNC_DIGEST'
+SYNC_STATE = 'SYNC_STATE'
 
 FIRST_PHASE = 'first phase'
 SECOND_PHASE = 'second phase'
 THIRD_PHASE = 'third phase'
+SYNC = 'sync'
 
 RESPONSE_TIME = 0.21
 SLEEP_TIME = RESPONSE_TIME
 K = 3
 
 ALIVE = 1
+SUSPECT = 3
 DEAD = 5
 
 
 class GroupMember(Process):
+    # every membership change is piggybacked RETRANSMIT_MULT * log N times, at most PIGGYBACK_LIMIT changes per message
+    RETRANSMIT_MULT = 3
+    PIGGYBACK_LIMIT = 32
+    # a suspect is declared dead after SUSPICION_MULT * log10 N probe periods, or right away if it is 0
+    SUSPICION_MULT = 4
+    # probe timeouts are stretched up to 1 + LHM_MAX times while probes of this node fail
+    LHM_MAX = 8
+    # dead members are forgotten after TOMBSTONE_TIME, news about unknown dead members are ignored,
+    # forgotten members are still synced with from time to time for TOMBSTONE_TIME more,
+    # so the group heals after long partitions
+    TOMBSTONE_TIME = 60
+    # the whole table is synced with the seed on join and with a random member every SYNC_INTERVAL, never if it is 0
+    SYNC_INTERVAL = 5
+
     def __init__(self, proc_id: str):
         self._id = proc_id
-        self._group = {}  # id -> status
         self._in_group_now = False
 
-        self._members_timers = {}  # id -> incarnation iteration
+        # member table: a record of every known member lives in the same slot of the lists below
+        self._slots = {}  # id -> slot
+        self._ids = []  # slot -> id, None for a free slot
+        self._statuses = []
+        self._incarnations = []
+        self._changed_at = []  # local time of the last status change
+        self._free_slots = []
+        # ordered sets as dicts with None values, so iteration does not depend on string hashing
+        self._live = {}  # ids of members that are not dead
+        self._suspects = {}  # ids of suspected members, suspected since their last status change
+        self._forgotten = collections.deque()  # (time, id) of reclaimed dead members, oldest first
+
         self._incarnation_counter = 0
 
+        self._health = 0  # local health multiplier, grows when this node seems to be slow
+
+        self._updates = {}  # id -> how many more times the change of its membership is piggybacked
+        self._update_queue = {}  # how many more times -> ids, in the order they got there
+
+        # members in a shuffled order, probed round-robin, and the position of the next one to probe
+        self._probe_order = []
+        self._probe_index = 0
+
         self._phase_start_time = 0
         self._suspected_id = None
         self._got_suspected_ack = False
@@ -36,32 +79,30 @@ class GroupMember(Process):
         self._in_group_now = True
 
         seed = msg['seed']
-        if seed == self._id:
-            self._group.clear()
-        else:
+        for timer_name in [SECOND_PHASE, THIRD_PHASE]:
+            ctx.cancel_timer(timer_name)
+        self._suspected_id = None
+        self._clear_members()
+        if seed != self._id:
             ctx.send(Message(JOIN, {
                 'newcomer': self._id,
                 'incarnation': self._incarnation_counter,
             }), seed)
-            self._group = {
-                seed: ALIVE
-            }
+            self._add_member(seed, ALIVE, 0, ctx.time())
 
         ctx.set_timer(FIRST_PHASE, SLEEP_TIME)
+        if self.SYNC_INTERVAL:
+            ctx.set_timer(SYNC, self.SYNC_INTERVAL)
 
     def _process_local_leave(self, msg: Message, ctx: Context):
-        for timer_name in [FIRST_PHASE, SECOND_PHASE, THIRD_PHASE]:
+        for timer_name in [FIRST_PHASE, SECOND_PHASE, THIRD_PHASE, SYNC]:
             ctx.cancel_timer(timer_name)
 
         self._in_group_now = False
-        self._group.clear()
+        self._clear_members()
 
     def _process_local_get_members(self, msg: Message, ctx: Context) -> list:
-        return [
-            node_id
-            for node_id, status in self._group.items()
-            if status == ALIVE
-        ] + [self._id]
+        return list(self._live) + [self._id]
 
     def on_local_message(self, msg: Message, ctx: Context):
         if msg.type == 'JOIN':
@@ -77,48 +118,201 @@ class GroupMember(Process):
             members = self._process_local_get_members(msg, ctx)
             ctx.send_local(Message('MEMBERS', {'members': members}))
 
+    def _clear_members(self):
+        for table in [self._slots, self._ids, self._statuses, self._incarnations, self._changed_at, self._free_slots,
+                      self._live, self._suspects, self._forgotten, self._updates, self._update_queue, self._probe_order]:
+            table.clear()
+        self._probe_index = 0
+
+    def _add_member(self, node_id: str, status: int, incarnation: int, now: float):
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._ids[slot], self._statuses[slot] = node_id, None
+        else:
+            slot = len(self._ids)
+            self._ids.append(node_id)
+            self._statuses.append(None)
+            self._incarnations.append(0)
+            self._changed_at.append(now)
+        self._slots[node_id] = slot
+        self._incarnations[slot] = incarnation
+        self._add_to_probe_order(node_id)
+        self._set_status(node_id, status, now)
+
+    def _reclaim_tombstones(self, now: float):
+        for slot, node_id in enumerate(self._ids):
+            if node_id is None or self._statuses[slot] != DEAD or now - self._changed_at[slot] < self.TOMBSTONE_TIME:
+                continue
+            del self._slots[node_id]
+            if self.SYNC_INTERVAL:
+                self._forgotten.append((now, node_id))
+            self._forget_update(node_id)
+            self._ids[slot] = None
+            self._free_slots.append(slot)
+
+    def _status(self, node_id: str) -> int:
+        return self._statuses[self._slots[node_id]]
+
+    def _incarnation(self, node_id: str) -> int:
+        return self._incarnations[self._slots[node_id]]
+
+    def _add_to_probe_order(self, node_id: str):
+        """
+        Puts a new member at a random position among the ones not probed yet in the current pass.
+        """
+        self._probe_order.append(node_id)
+        position = random.randint(self._probe_index, len(self._probe_order) - 1)
+        self._probe_order[position], self._probe_order[-1] = self._probe_order[-1], self._probe_order[position]
+
+    def _start_probe_pass(self, now: float):
+        # the only full scan of the member table, once per pass
+        self._reclaim_tombstones(now)
+        self._probe_order = [node_id for node_id in self._ids if node_id is not None]
+        random.shuffle(self._probe_order)
+        self._probe_index = 0
+
+    def _next_probe_target(self) -> str:
+        node_id = self._probe_order[self._probe_index]
+        self._probe_index += 1
+        return node_id
+
+    def _updated(self, node_id: str):
+        self._queue_update(node_id, self.RETRANSMIT_MULT * math.ceil(math.log2(len(self._slots) + 2)))
+
+    def _queue_update(self, node_id: str, count: int):
+        self._forget_update(node_id)
+        if count:
+            self._updates[node_id] = count
+            self._update_queue.setdefault(count, {})[node_id] = None
+
+    def _forget_update(self, node_id: str):
+        count = self._updates.pop(node_id, None)
+        if count is not None:
+            ids = self._update_queue[count]
+            del ids[node_id]
+            if not ids:
+                del self._update_queue[count]
+
+    def _set_status(self, node_id: str, status: int, now: float):
+        slot = self._slots[node_id]
+        if self._statuses[slot] == status:
+            return
+        self._statuses[slot] = status
+        self._changed_at[slot] = now
+        if status == DEAD:
+            self._live.pop(node_id, None)
+        else:
+            self._live[node_id] = None
+        if status == SUSPECT:
+            self._suspects[node_id] = None
+        else:
+            self._suspects.pop(node_id, None)
+        self._updated(node_id)
+
+    def _response_time(self) -> float:
+        return RESPONSE_TIME * (1 + self._health)
+
+    def _change_health(self, delta: int):
+        self._health = min(self.LHM_MAX, max(0, self._health + delta))
+
+    def _expire_suspects(self, now: float):
+        timeout = self.SUSPICION_MULT * max(1., math.log10(len(self._slots) + 1)) * 3 * SLEEP_TIME * (1 + self._health)
+        expired = [node_id for node_id in self._suspects if now - self._changed_at[self._slots[node_id]] >= timeout]
+        for node_id in expired:
+            self._set_status(node_id, DEAD, now)
+
     def _create_multicast_info(self):
-        nodes_ids = random.sample(list(self._group.keys()), min(K, len(self._group)))
+        """
+        Takes up to PIGGYBACK_LIMIT least disseminated membership changes and K random members.
+        """
+        nodes_ids = []
+        # there are at most RETRANSMIT_MULT * log N distinct counts
+        for count in sorted(self._update_queue, reverse=True):
+            nodes_ids += itertools.islice(self._update_queue[count], self.PIGGYBACK_LIMIT - len(nodes_ids))
+            if len(nodes_ids) == self.PIGGYBACK_LIMIT:
+                break
+        for node_id in nodes_ids:
+            self._queue_update(node_id, self._updates[node_id] - 1)
+        nodes_ids += random.sample(self._probe_order, min(K, len(self._probe_order)))
 
         info = {
-            node_id: (
-                self._group[node_id],
-                self._members_timers[node_id] if node_id in self._members_timers else 0
-            )
+            node_id: (self._status(node_id), self._incarnation(node_id))
             for node_id in nodes_ids
         }
         info[self._id] = (ALIVE, self._incarnation_counter)
         return info
 
-    def _apply_multicast_info(self, info):
+    def _apply_multicast_info(self, info, now: float):
         for node_id, (status, incarnation) in info.items():
 
             if node_id == self._id:
 
-                if status == DEAD:
-                    self._incarnation_counter = 1 + max(incarnation, self._incarnation_counter)
+                # refute the suspicion with a new incarnation, being suspected also means that this node may be slow
+                if status != ALIVE and incarnation >= self._incarnation_counter:
+                    self._incarnation_counter = incarnation + 1
+                    self._change_health(1)
 
                 continue
 
             # process if not in group
-            if node_id not in self._group:
-                self._group[node_id] = status
-                self._members_timers[node_id] = incarnation
+            if node_id not in self._slots:
+                if status != DEAD:
+                    self._add_member(node_id, status, incarnation, now)
                 continue
 
-            self._members_timers.setdefault(node_id, 0)
+            slot = self._slots[node_id]
 
-            if incarnation == self._members_timers[node_id]:
+            if incarnation == self._incarnations[slot]:
 
-                if status == DEAD or self._group[node_id] == DEAD:
-                    self._group[node_id] = DEAD
-                else:
-                    self._group[node_id] = ALIVE
+                if status > self._statuses[slot]:
+                    self._set_status(node_id, status, now)
 
-            elif incarnation > self._members_timers[node_id]:
+            elif incarnation > self._incarnations[slot]:
 
-                self._group[node_id] = status
-                self._members_timers[node_id] = incarnation
+                self._incarnations[slot] = incarnation
+                self._set_status(node_id, status, now)
+
+    def _digest(self) -> int:
+        """
+        Order-independent checksum of the live members, equal on members with the same view of the group.
+        """
+        digest = zlib.crc32('{}:{}:{}'.format(self._id, ALIVE, self._incarnation_counter).encode())
+        for node_id in self._live:
+            digest ^= zlib.crc32('{}:{}:{}'.format(node_id, self._status(node_id), self._incarnation(node_id)).encode())
+        return digest
+
+    def _pack_state(self) -> str:
+        """
+        Returns the whole member table in the multicast info format, compressed.
+        """
+        info = {node_id: (self._status(node_id), self._incarnation(node_id)) for node_id in self._slots}
+        info[self._id] = (ALIVE, self._incarnation_counter)
+        return base64.b64encode(zlib.compress(json.dumps(info).encode())).decode()
+
+    def _send_state(self, to: str, reply: bool, ctx: Context):
+        ctx.send(Message(SYNC_STATE, {'state': self._pack_state(), 'reply': reply}), to)
+
+    def _process_sync_digest(self, msg: Message, sender: str, ctx: Context):
+        """
+        BODY: {
+            'digest'
+        }
+        """
+
+        if msg['digest'] != self._digest():
+            self._send_state(sender, True, ctx)
+
+    def _process_sync_state(self, msg: Message, sender: str, ctx: Context):
+        """
+        BODY: {
+            'state'
+            'reply'
+        }
+        """
+
+        if msg['reply']:
+            self._send_state(sender, False, ctx)
+        self._apply_multicast_info(json.loads(zlib.decompress(base64.b64decode(msg['state']))), ctx.time())
 
     def _process_ping(self, msg: Message, sender: str, ctx: Context):
         """
@@ -128,7 +322,7 @@ class GroupMember(Process):
         }
         """
 
-        self._apply_multicast_info(msg['multicast info'])
+        self._apply_multicast_info(msg['multicast info'], ctx.time())
 
         ctx.send(Message(
             ACK,
@@ -146,7 +340,7 @@ class GroupMember(Process):
         }
         """
 
-        self._apply_multicast_info(msg['multicast info'])
+        self._apply_multicast_info(msg['multicast info'], ctx.time())
 
         ctx.send(Message(
             PING,
@@ -182,21 +376,25 @@ class GroupMember(Process):
             return
 
         if msg.type == JOIN:
-            nodes_ids = random.sample(list(self._group.keys()), min(K, len(self._group)))
-
-            for node_id in nodes_ids:
-                ctx.send(Message(
-                    PING_REQ,
-                    {
-                        'suspect': msg['newcomer'],
-                        'multicast info': {
-                            msg['newcomer']: (ALIVE, msg['incarnation'])
-                        },
-                    }
-                ), node_id)
-
-            self._group[sender] = ALIVE
-            self._members_timers[sender] = msg['incarnation']
+            nodes_ids = random.sample(self._probe_order, min(K, len(self._probe_order)))
+
+            ctx.send_many(Message(
+                PING_REQ,
+                {
+                    'suspect': msg['newcomer'],
+                    'multicast info': {
+                        msg['newcomer']: (ALIVE, msg['incarnation'])
+                    },
+                }
+            ), nodes_ids)
+
+            if sender not in self._slots:
+                self._add_member(sender, ALIVE, msg['incarnation'], ctx.time())
+            else:
+                self._incarnations[self._slots[sender]] = msg['incarnation']
+                self._set_status(sender, ALIVE, ctx.time())
+            if self.SYNC_INTERVAL:
+                self._send_state(sender, False, ctx)
 
         if msg.type == PING:
 
@@ -210,27 +408,39 @@ class GroupMember(Process):
 
             self._process_ack(msg, sender, ctx)
 
+        elif msg.type == SYNC_DIGEST:
+
+            self._process_sync_digest(msg, sender, ctx)
+
+        elif msg.type == SYNC_STATE:
+
+            self._process_sync_state(msg, sender, ctx)
+
     def _send_one_random_ping(self, ctx):
         self._phase_start_time = ctx.time()
         self._got_suspected_ack = False
-        self._suspected_id = random.choice(list(self._group.keys()))
+        self._suspected_id = self._next_probe_target()
+
+        info = self._create_multicast_info()
+        # a suspected or dead member learns about it right away and can refute
+        if self._status(self._suspected_id) != ALIVE:
+            info[self._suspected_id] = (self._status(self._suspected_id), self._incarnation(self._suspected_id))
 
         ctx.send(Message(
             PING,
             {
                 'requester': self._id,
-                'multicast info': self._create_multicast_info(),
+                'multicast info': info,
             }
         ),  self._suspected_id)
 
     def _send_random_ping_requests(self, ctx):
         self._phase_start_time = ctx.time()
 
-        nodes_ids = random.sample(list(self._group.keys()), min(K + 1, len(self._group)))
+        nodes_ids = random.sample(self._probe_order, min(K + 1, len(self._probe_order)))
         if self._suspected_id not in nodes_ids:
             nodes_ids = nodes_ids[:-1]
         else:
-            nodes_ids = set(nodes_ids)
             nodes_ids.remove(self._suspected_id)
 
         for node_id in nodes_ids:
@@ -248,13 +458,17 @@ class GroupMember(Process):
             Send one ping
             """
 
+            self._expire_suspects(ctx.time())
+            if self._probe_index >= len(self._probe_order):
+                self._start_probe_pass(ctx.time())
+
             # sleep again if there is no members
-            if not self._group:
+            if not self._probe_order:
                 ctx.set_timer(FIRST_PHASE, SLEEP_TIME)
                 return
 
             self._send_one_random_ping(ctx)
-            ctx.set_timer(SECOND_PHASE, SLEEP_TIME)
+            ctx.set_timer(SECOND_PHASE, self._response_time())
 
         elif timer_name == SECOND_PHASE:
             """
@@ -262,13 +476,13 @@ class GroupMember(Process):
             """
 
             # sleep again if woke up too early
-            if ctx.time() - self._phase_start_time < RESPONSE_TIME:
+            if ctx.time() - self._phase_start_time < self._response_time():
                 ctx.set_timer(SECOND_PHASE, SLEEP_TIME)
                 return
 
             if not self._got_suspected_ack:
                 self._send_random_ping_requests(ctx)
-            ctx.set_timer(THIRD_PHASE, SLEEP_TIME)
+            ctx.set_timer(THIRD_PHASE, self._response_time())
 
         elif timer_name == THIRD_PHASE:
             """
@@ -276,14 +490,36 @@ class GroupMember(Process):
             """
 
             # sleep again if woke up too early
-            if ctx.time() - self._phase_start_time < RESPONSE_TIME:
+            if ctx.time() - self._phase_start_time < self._response_time():
                 ctx.set_timer(THIRD_PHASE, SLEEP_TIME)
                 return
 
-            if not self._got_suspected_ack:
-                self._group[self._suspected_id] = DEAD
-            else:
-                self._group[self._suspected_id] = ALIVE
+            # a member that acked is not cleared here: only the member itself refutes a suspicion,
+            # failed probes of members that are already suspected or dead say nothing about our own health
+            if self._got_suspected_ack:
+                self._change_health(-1)
+            elif self._status(self._suspected_id) == ALIVE:
+                self._change_health(1)
+                self._set_status(self._suspected_id, SUSPECT if self.SUSPICION_MULT else DEAD, ctx.time())
             self._suspected_id = None
 
             ctx.set_timer(FIRST_PHASE, SLEEP_TIME)
+
+        elif timer_name == SYNC:
+            """
+            Start the push-pull sync with a random member, the tables are exchanged only if the digests differ.
+            A random forgotten member is synced with too: if it is reachable again, the sync brings it back.
+            """
+
+            nodes_ids = []
+            if self._probe_order:
+                node_id = random.choice(self._probe_order)
+                if node_id in self._live:
+                    nodes_ids.append(node_id)
+            while self._forgotten and ctx.time() - self._forgotten[0][0] >= self.TOMBSTONE_TIME:
+                self._forgotten.popleft()
+            if self._forgotten:
+                nodes_ids.append(self._forgotten[random.randrange(len(self._forgotten))][1])
+            if nodes_ids:
+                ctx.send_many(Message(SYNC_DIGEST, {'digest': self._digest()}), nodes_ids)
+            ctx.set_timer(SYNC, self.SYNC_INTERVAL)
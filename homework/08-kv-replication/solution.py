@@ -1,5 +1,5 @@
 import hashlib
-from dslabmp import Context, Message, Process
+from dslabmp import Context, Message, Process, TrackedDict
 from typing import List
 
 TIMER_TIME = 0.5
@@ -27,12 +27,12 @@ class StorageNode(Process):
         """
         KEY -> VALUE
         """
-        self._data = {}
+        self._data = TrackedDict()
 
         """
         KEY -> OPERATION TIME
         """
-        self._operations_times = {}
+        self._operations_times = TrackedDict()
 
         """
         QUORUM_ID -> {QUORUM: number, ANSWERS: [], REQUEST_INFO: {}}
@@ -0,0 +1,45 @@
+"""
+Micro-benchmarks for the Python side of dslab-mp.
+
+Usage: python bench.py <benchmark> [options], see python bench.py -h for the list of benchmarks.
+Every benchmark lives in the benchmarks package next to its options.
+"""
+import argparse
+from typing import Any, Dict
+
+from benchmarks import broadcast, guarantees, membership, messages, sharding, simulation, snapshots
+
+BENCHMARKS: Dict[str, Any] = {
+    'broadcast': (broadcast.bench_broadcast, broadcast.add_broadcast_args,
+                  'all-to-all broadcast with shared and per-destination encoding'),
+    'dissemination': (broadcast.bench_dissemination, broadcast.add_dissemination_args,
+                      'message count and latency of flooding and gossip'),
+    'membership': (membership.bench_membership, membership.add_membership_args,
+                   'convergence time and traffic of a joining membership group'),
+    'failure-detection': (membership.bench_failure_detection, membership.add_failure_detection_args,
+                          'false positives and crash detection time of a membership group under load'),
+    'codecs': (messages.bench_codecs, messages.add_codecs_args, 'message encoding and decoding throughput'),
+    'forward': (messages.bench_forward, messages.add_forward_args, 'gossip relay of a received message to all peers'),
+    'guarantees': (guarantees.bench_guarantees, guarantees.add_guarantees_args,
+                   'time and messages to deliver a burst with every guarantee'),
+    'mc': (guarantees.bench_mc, guarantees.add_mc_args, 'model checking of delivery guarantees on a pool of workers'),
+    'sharded': (sharding.bench_sharded, sharding.add_sharded_args,
+                'membership cluster on a sharded simulation compared to a single thread'),
+    'sim': (simulation.bench_sim, simulation.add_sim_args,
+            'events per second of simulated key-value storage under client operations'),
+    'snapshots': (snapshots.bench_snapshots, snapshots.add_snapshots_args,
+                  'process state snapshots of a node with a large key-value map'),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    for name, (_, add_args, help_text) in BENCHMARKS.items():
+        add_args(subparsers.add_parser(name, help=help_text))
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark][0](args)
+
+
+if __name__ == '__main__':
+    main()
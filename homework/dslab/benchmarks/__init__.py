@@ -0,0 +1,3 @@
+"""
+Micro-benchmarks for the Python side of dslab-mp, a module per topic, run by bench.py.
+"""
@@ -0,0 +1,144 @@
+"""
+Broadcast: encoding of all-to-all messages and dissemination by flooding and gossip.
+"""
+import argparse
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from dslabmp import Context, Message
+from simulator import Simulation, load_process_class
+
+from .common import HOMEWORK_DIR, print_table
+
+
+# ENCODING -------------------------------------------------------------------------------------------------------------
+
+class _PerDestinationContext(Context):
+    """
+    Context that encodes a message separately for every destination, as a loop over send() does.
+    """
+
+    def send_many(self, msg: Message, to: Iterable[str]):
+        for proc in to:
+            self.send(msg, proc)
+
+
+def _run_all_to_all(process_class: type, process_count: int, broadcasts: int, burst: int,
+                    context_class: type) -> Dict[str, int]:
+    ids = [str(i) for i in range(process_count)]
+    processes = {proc_id: process_class(proc_id, ids) for proc_id in ids}
+    # batches are delivered in FIFO order, every batch holds the messages sent by one process to another in one step,
+    # a step handles a burst of local messages or a whole received batch with one context
+    in_flight = deque()
+    stats = {'messages': 0, 'batches': 0, 'delivered': 0}
+
+    def handle(proc_id: str, call: Callable[[Context], None]):
+        ctx = context_class(0)
+        call(ctx)
+        stats['delivered'] += len(ctx._sent_local_messages)
+        for to, batch in ctx.drain_batches().items():
+            stats['messages'] += len(batch)
+            stats['batches'] += 1
+            in_flight.append((proc_id, to, batch))
+
+    def receive(proc_id: str, sender: str, batch: List[Tuple[str, Any]], ctx: Context):
+        for message_type, payload in batch:
+            processes[proc_id].on_message(Message.decode(message_type, payload), sender, ctx)
+
+    for step, first in enumerate(range(0, broadcasts, burst)):
+        proc_id = ids[step % process_count]
+        burst_msgs = [
+            Message('SEND', {'text': 'message {}'.format(i)}) for i in range(first, min(first + burst, broadcasts))
+        ]
+        handle(proc_id, lambda ctx: [processes[proc_id].on_local_message(msg, ctx) for msg in burst_msgs])
+    while in_flight:
+        sender, to, batch = in_flight.popleft()
+        handle(to, lambda ctx: receive(to, sender, batch, ctx))
+    return stats
+
+
+def bench_broadcast(args):
+    process_class = load_process_class(args.impl, 'BroadcastProcess')
+    rows = []
+    for name, context_class in [('per-destination', _PerDestinationContext), ('shared', Context)]:
+        start = time.perf_counter()
+        stats = _run_all_to_all(process_class, args.processes, args.broadcasts, args.burst, context_class)
+        elapsed = time.perf_counter() - start
+        # messages sent to one destination in one step have to be coalesced into one batch
+        assert args.burst == 1 or stats['batches'] < stats['messages'], 'no messages were batched'
+        rows.append([
+            name, stats['messages'], stats['batches'], stats['delivered'],
+            '{:.2f}'.format(elapsed), '{:.0f}'.format(stats['messages'] / elapsed),
+        ])
+    print_table(['encoding', 'messages', 'batches', 'delivered', 'time s', 'messages/s'], rows)
+
+
+def add_broadcast_args(parser: argparse.ArgumentParser):
+    parser.add_argument('--impl', default=os.path.join(HOMEWORK_DIR, '04-broadcast', 'solution.py'),
+                        help='path to solution with BroadcastProcess class')
+    parser.add_argument('--processes', type=int, default=10, help='number of processes')
+    parser.add_argument('--broadcasts', type=int, default=20, help='number of broadcasted messages')
+    parser.add_argument('--burst', type=int, default=4, help='messages broadcasted by a process in one step')
+
+
+# DISSEMINATION --------------------------------------------------------------------------------------------------------
+
+def _run_dissemination(process_class: type, process_count: int, args) -> Dict[str, float]:
+    sim = Simulation(args.seed)
+    sim.network.set_delays(args.min_delay, args.max_delay)
+    ids = [str(i) for i in range(process_count)]
+    for proc_id in ids:
+        sim.add_process(proc_id, process_class(proc_id, ids))
+    rand = random.Random(args.seed)
+    sent_at = {}
+    for i in range(args.broadcasts):
+        text = 'message {}'.format(i)
+        sent_at[text] = i * args.interval
+        sim.send_local_message(rand.choice(ids), Message('SEND', {'text': text}), sent_at[text])
+    sim.run()
+    # latency of a message is the time until the last process delivered it
+    delivered_at = {}
+    for proc_id in ids:
+        for deliver_time, msg in sim.local_messages(proc_id):
+            delivered_at[msg['text']] = max(delivered_at.get(msg['text'], 0.), deliver_time)
+    latencies = [delivered_at[text] - sent_at[text] for text in sent_at if text in delivered_at]
+    return {
+        'messages': sim.network_message_count() / args.broadcasts,
+        'traffic': sim.traffic() / args.broadcasts,
+        'latency': sum(latencies) / len(latencies) if latencies else float('nan'),
+        'max latency': max(latencies, default=float('nan')),
+        'delivered': sum(len(sim.local_messages(proc_id)) for proc_id in ids) / (args.broadcasts * process_count),
+    }
+
+
+def bench_dissemination(args):
+    process_class = load_process_class(args.impl, 'BroadcastProcess')
+    modes = [('flooding', process_class)] + [
+        ('gossip f={}'.format(fanout), type('GossipProcess', (process_class,), {'GOSSIP_FANOUT': fanout}))
+        for fanout in args.fanouts or [2, 4]
+    ]
+    rows = []
+    for process_count in args.sizes:
+        for name, mode_class in modes:
+            stats = _run_dissemination(mode_class, process_count, args)
+            rows.append([
+                process_count, name, '{:.0f}'.format(stats['messages']), '{:.0f}'.format(stats['traffic']),
+                '{:.2f}'.format(stats['latency']), '{:.2f}'.format(stats['max latency']),
+                '{:.0%}'.format(stats['delivered']),
+            ])
+    print_table(['N', 'mode', 'msgs/bcast', 'bytes/bcast', 'latency', 'max latency', 'delivered'], rows)
+
+
+def add_dissemination_args(parser: argparse.ArgumentParser):
+    parser.add_argument('--impl', default=os.path.join(HOMEWORK_DIR, '04-broadcast', 'solution.py'),
+                        help='path to solution with BroadcastProcess class')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 20, 50, 100, 200], help='numbers of processes')
+    parser.add_argument('--fanout', dest='fanouts', type=int, action='append', help='gossip fanout (default: 2, 4)')
+    parser.add_argument('--broadcasts', type=int, default=5, help='number of broadcasted messages')
+    parser.add_argument('--interval', type=float, default=10, help='time between broadcasts')
+    parser.add_argument('--min-delay', type=float, default=1, help='minimum network delay')
+    parser.add_argument('--max-delay', type=float, default=1, help='maximum network delay')
+    parser.add_argument('--seed', type=int, default=123, help='random seed')
@@ -0,0 +1,21 @@
+"""
+Helpers shared by the benchmarks.
+"""
+import os
+import time
+from typing import Any, Callable, List
+
+HOMEWORK_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def ops_per_sec(fn: Callable[[], Any], count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return count / (time.perf_counter() - start)
+
+
+def print_table(header: List[str], rows: List[List[Any]]):
+    widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        print('  '.join(str(cell).ljust(width) for cell, width in zip(row, widths)).rstrip())
@@ -0,0 +1,118 @@
+"""
+Delivery guarantees: simulated delivery of a burst and model checking.
+"""
+import argparse
+import os
+
+from dslabmp import Message
+from modelcheck import DROPPED, DUPLICATED, RECEIVED, TIMERS_FIRED, ModelChecker, McState, all_of, any_of, \
+    counter_limit, got_n_local_messages, no_events
+from simulator import Simulation, load_process_class
+
+from .common import HOMEWORK_DIR, print_table
+
+
+# GUARANTEES -----------------------------------------------------------------------------------------------------------
+
+_GUARANTEES = {
+    'at-most-once': ('AtMostOnce', False, True, False),
+    'at-least-once': ('AtLeastOnce', True, False, False),
+    'exactly-once': ('ExactlyOnce', True, True, False),
+    'exactly-once-ordered': ('ExactlyOnceOrdered', True, True, True),
+}
+
+
+def bench_guarantees(args):
+    networks = {
+        'reliable': (args.min_delay, args.max_delay, 0., 0.),
+        'faulty': (args.min_delay, args.max_delay, args.drop_rate, args.dupl_rate),
+    }
+    texts = ['message-{}'.format(i) for i in range(args.messages)]
+    rows = []
+    for guarantee in args.guarantees or list(_GUARANTEES):
+        prefix = _GUARANTEES[guarantee][0]
+        sender_class = load_process_class(args.impl, prefix + 'Sender')
+        receiver_class = load_process_class(args.impl, prefix + 'Receiver')
+        for network, (min_delay, max_delay, drop_rate, dupl_rate) in networks.items():
+            sim = Simulation(args.seed)
+            sim.network.set_delays(min_delay, max_delay)
+            sim.network.set_drop_rate(drop_rate)
+            sim.network.set_dupl_rate(dupl_rate)
+            sim.add_process('sender', sender_class('sender', 'receiver'))
+            sim.add_process('receiver', receiver_class('receiver'))
+            # the whole burst is sent at once, so the time to deliver it depends on the window and the timeouts
+            for text in texts:
+                sim.send_local_message('sender', Message('MESSAGE', {'text': text}))
+            sim.run()
+            delivered = [msg['text'] for msg in sim.read_local_messages('receiver')]
+            rows.append([
+                guarantee, network, '{:.0f}'.format(sim.time()), len(delivered), len(set(delivered)),
+                sim.sent_message_count('sender'), sim.sent_message_count('receiver'),
+            ])
+    print_table(['guarantee', 'network', 'time', 'delivered', 'unique', 'sender msgs', 'receiver msgs'], rows)
+
+
+def add_guarantees_args(parser: argparse.ArgumentParser):
+    parser.add_argument('--impl', default=os.path.join(HOMEWORK_DIR, '01-guarantees', 'solution.py'),
+                        help='path to solution with sender and receiver classes')
+    parser.add_argument('--guarantee', dest='guarantees', choices=list(_GUARANTEES), action='append',
+                        help='measured guarantee (default: all)')
+    parser.add_argument('--messages', type=int, default=1000, help='number of messages in the burst')
+    parser.add_argument('--min-delay', type=float, default=1, help='minimal message delay')
+    parser.add_argument('--max-delay', type=float, default=3, help='maximal message delay')
+    parser.add_argument('--drop-rate', type=float, default=0.3, help='drop rate of the faulty network')
+    parser.add_argument('--dupl-rate', type=float, default=0.3, help='duplication rate of the faulty network')
+    parser.add_argument('--seed', type=int, default=123, help='random seed')
+
+
+# MODEL CHECKING -------------------------------------------------------------------------------------------------------
+
+def bench_mc(args):
+    prefix, reliable, once, ordered = _GUARANTEES[args.guarantee]
+    sender_class = load_process_class(args.impl, prefix + 'Sender')
+    receiver_class = load_process_class(args.impl, prefix + 'Receiver')
+    texts = ['message-{}'.format(i) for i in range(args.messages)]
+
+    def invariant(state: McState):
+        delivered = [msg['text'] for msg in state.local_outbox('receiver')]
+        if any(text not in texts for text in delivered):
+            return 'unexpected message delivered'
+        if once and len(set(delivered)) != len(delivered):
+            return 'message delivered twice'
+        if ordered and delivered != sorted(set(delivered), key=texts.index):
+            return 'messages delivered out of order'
+        if reliable and not state.events and set(delivered) != set(texts):
+            return 'message lost'
+        return None
+
+    checker = ModelChecker(
+        lambda: {'sender': sender_class('sender', 'receiver'), 'receiver': receiver_class('receiver')},
+        invariant=invariant,
+        goal=all_of([got_n_local_messages('receiver', len(texts)), no_events()]) if reliable and once else no_events(),
+        prune=any_of([
+            counter_limit(DROPPED, 1), counter_limit(DUPLICATED, 1), counter_limit(TIMERS_FIRED, 1),
+            counter_limit(RECEIVED, len(texts) + 1),
+        ]),
+        drops=True, duplications=True,
+    )
+    initial_messages = [('sender', Message('MESSAGE', {'text': text})) for text in texts]
+    rows = []
+    for strategy in args.strategies or ['bfs', 'dfs', 'random']:
+        for workers in args.workers or [1, 2]:
+            result = checker.run(initial_messages, strategy, workers, walks=args.walks, seed=args.seed)
+            rows.append([
+                strategy, workers, result['states'], result['unique_states'], result['goals'], result['max_depth'],
+                '{:.2f}'.format(result['elapsed']), '{:.0f}'.format(result['states_per_sec']), result['error'] or 'ok',
+            ])
+    print_table(['strategy', 'workers', 'states', 'unique', 'goals', 'depth', 'time s', 'states/s', 'result'], rows)
+
+
+def add_mc_args(parser: argparse.ArgumentParser):
+    parser.add_argument('--impl', default=os.path.join(HOMEWORK_DIR, '01-guarantees', 'solution.py'),
+                        help='path to solution with sender and receiver classes')
+    parser.add_argument('--guarantee', choices=list(_GUARANTEES), default='exactly-once', help='checked guarantee')
+    parser.add_argument('--messages', type=int, default=2, help='number of messages to deliver')
+    parser.add_argument('--strategy', dest='strategies', action='append', help='search strategy (default: all)')
+    parser.add_argument('--workers', type=int, action='append', help='number of workers (default: 1 and 2)')
+    parser.add_argument('--walks', type=int, default=2000, help='number of walks of the random strategy')
+    parser.add_argument('--seed', type=int, default=123, help='random seed')
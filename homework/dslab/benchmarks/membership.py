@@ -0,0 +1,150 @@
+"""
+Group membership: convergence and failure detection.
+"""
+import argparse
+import os
+from typing import Dict, List
+
+from dslabmp import Message
+from simulator import Simulation, load_process_class
+
+from .common import HOMEWORK_DIR, print_table
+
+
+def _read_views(sim, nodes: List[str]) -> List[List[str]]:
+    for node_id in nodes:
+        sim.send_local_message(node_id, Message('GET_MEMBERS', {}))
+    sim.run(until=sim.time())
+    return [sim.read_local_messages(node_id)[-1]['members'] for node_id in nodes]
+
+
+def _wait_for_view(sim, nodes: List[str], args) -> float:
+    """
+    Returns the time it took for every node to get exactly the given nodes as members, or None on timeout.
+    """
+    start, expected = sim.time(), sorted(nodes)
+    while sim.time() - start < args.max_time:
+        sim.step_for_duration(args.check_interval)
+        if all(sorted(view) == expected for view in _read_views(sim, nodes)):
+            return sim.time() - start
+    return None
+
+
+# CONVERGENCE ----------------------------------------------------------------------------------------------------------
+
+def _run_convergence(node_class: type, node_count: int, args) -> Dict[str, float]:
+    sim = Simulation(args.seed)
+    sim.network.set_delays(args.min_delay, args.max_delay)
+    nodes = [str(i) for i in range(node_count + 1)]
+    for node_id in nodes:
+        sim.add_process(node_id, node_class(node_id))
+    for node_id in nodes[:-1]:
+        sim.send_local_message(node_id, Message('JOIN', {'seed': nodes[0]}))
+    stats = {'group join': _wait_for_view(sim, nodes[:-1], args)}
+    if stats['group join'] is None:
+        return stats
+    # traffic of the steady state, once every node knows the whole group
+    messages, traffic = sim.network_message_count(), sim.traffic()
+    sim.step_for_duration(args.steady_time)
+    messages, traffic = sim.network_message_count() - messages, sim.traffic() - traffic
+    stats['bytes per message'] = traffic / messages
+    stats['messages per node'] = messages / args.steady_time / node_count
+    # spread of single changes in the converged group
+    sim.send_local_message(nodes[-1], Message('JOIN', {'seed': nodes[0]}))
+    stats['join'] = _wait_for_view(sim, nodes, args)
+    sim.crash_process(nodes[1])
+    stats['crash'] = _wait_for_view(sim, nodes[:1] + nodes[2:], args)
+    return stats
+
+
+def bench_membership(args):
+    node_class = load_process_class(args.impl, 'GroupMember')
+    modes = [('random K', type('RandomSamplingMember', (node_class,), {'PIGGYBACK_LIMIT': 0, 'SYNC_INTERVAL': 0}))]
+    for mult in args.mults or [node_class.RETRANSMIT_MULT]:
+        modes += [
+            ('lambda={}'.format(mult),
+             type('DisseminatingMember', (node_class,), {'RETRANSMIT_MULT': mult, 'SYNC_INTERVAL': 0})),
+            ('lambda={} + sync'.format(mult),
+             type('SyncingMember', (node_class,), {'RETRANSMIT_MULT': mult})),
+        ]
+    rows = []
+    for node_count in args.sizes:
+        for name, mode_class in modes:
+            stats = _run_convergence(mode_class, node_count, args)
+            rows.append([node_count, name] + [
+                '-' if stats.get(key) is None else '{:.1f}'.format(stats[key])
+                for key in ['group join', 'join', 'crash', 'messages per node', 'bytes per message']
+            ])
+    print_table(['N', 'mode', 'group join', 'join', 'crash', 'msgs/node/s', 'bytes/msg'], rows)
+
+
+def add_membership_args(parser: argparse.ArgumentParser):
+    parser.add_argument('--impl', default=os.path.join(HOMEWORK_DIR, '06-membership', 'solution.py'),
+                        help='path to solution with GroupMember class')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 200, 500, 1000], help='numbers of group members')
+    parser.add_argument('--mult', dest='mults', type=int, action='append',
+                        help='retransmit multiplier of membership changes (default: the one of GroupMember)')
+    parser.add_argument('--max-time', type=float, default=300, help='simulated time to wait for every change to spread')
+    parser.add_argument('--check-interval', type=float, default=1, help='simulated time between membership checks')
+    parser.add_argument('--steady-time', type=float, default=5, help='simulated time to measure traffic after')
+    parser.add_argument('--min-delay', type=float, default=0.01, help='minimal message delay')
+    parser.add_argument('--max-delay', type=float, default=0.1, help='maximal message delay')
+    parser.add_argument('--seed', type=int, default=123, help='random seed')
+
+
+# FAILURE DETECTION ----------------------------------------------------------------------------------------------------
+
+def _run_failure_detection(node_class: type, node_count: int, args) -> Dict[str, float]:
+    sim = Simulation(args.seed)
+    sim.network.set_delays(args.min_delay, args.max_delay)
+    nodes = [str(i) for i in range(node_count)]
+    for node_id in nodes:
+        sim.add_process(node_id, node_class(node_id))
+    for node_id in nodes:
+        sim.send_local_message(node_id, Message('JOIN', {'seed': nodes[0]}))
+    if _wait_for_view(sim, nodes, args) is None:
+        return {}
+    # the load is modeled by network delays that often exceed the probe timeout
+    sim.network.set_delays(args.min_delay, args.load_delay)
+    missing, checks = 0, 0
+    while checks * args.check_interval < args.load_time:
+        sim.step_for_duration(args.check_interval)
+        missing += sum(node_count - len(view) for view in _read_views(sim, nodes))
+        checks += 1
+    sim.crash_process(nodes[-1])
+    return {
+        'false positives': missing / checks / (node_count * (node_count - 1)),
+        'detection': _wait_for_view(sim, nodes[:-1], args),
+    }
+
+
+def bench_failure_detection(args):
+    node_class = load_process_class(args.impl, 'GroupMember')
+    modes = [
+        ('no suspicion', type('NoSuspicionMember', (node_class,), {'SUSPICION_MULT': 0, 'LHM_MAX': 0})),
+        ('suspicion', type('SuspicionMember', (node_class,), {'LHM_MAX': 0})),
+        ('suspicion+lhm', node_class),
+    ]
+    rows = []
+    for node_count in args.sizes:
+        for name, mode_class in modes:
+            stats = _run_failure_detection(mode_class, node_count, args)
+            rows.append([
+                node_count, name,
+                '-' if 'false positives' not in stats else '{:.2%}'.format(stats['false positives']),
+                '-' if stats.get('detection') is None else '{:.1f}'.format(stats['detection']),
+            ])
+    print_table(['N', 'mode', 'false positives', 'detection'], rows)
+
+
+def add_failure_detection_args(parser: argparse.ArgumentParser):
+    parser.add_argument('--impl', default=os.path.join(HOMEWORK_DIR, '06-membership', 'solution.py'),
+                        help='path to solution with GroupMember class')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 50, 100], help='numbers of group members')
+    parser.add_argument('--load-delay', type=float, default=0.5, help='maximal message delay under load')
+    parser.add_argument('--load-time', type=float, default=60, help='simulated time under load before the crash')
+    parser.add_argument('--max-time', type=float, default=120, help='simulated time to wait for the crash to spread')
+    parser.add_argument('--check-interval', type=float, default=1, help='simulated time between membership checks')
+    parser.add_argument('--min-delay', type=float, default=0.01, help='minimal message delay')
+    parser.add_argument('--max-delay', type=float, default=0.1, help='maximal message delay before the load')
+    parser.add_argument('--seed', type=int, default=123, help='random seed')
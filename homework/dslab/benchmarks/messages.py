@@ -0,0 +1,85 @@
+"""
+Message encoding: codec throughput and relay of received messages.
+"""
+import argparse
+from typing import List
+
+from dslabmp import Context, Message, available_codecs, get_codec
+
+from .common import ops_per_sec, print_table
+
+
+# CODECS ---------------------------------------------------------------------------------------------------------------
+
+def _kv_messages() -> List[Message]:
+    return [
+        Message('PUT_REQ', {'key': 'key-4521', 'value': 'value-' + 'x' * 24, 'quorum_id': '17', 'operation_time': 12.5}),
+        Message('GET_ANSWER', {'key': 'key-4521', 'value': None, 'quorum_id': '18', 'operation_time': -1}),
+    ]
+
+
+def _broadcast_messages(process_count: int, history: int) -> List[Message]:
+    # the vector clock of a process that has delivered about history messages of every sender
+    return [
+        Message('BCAST', {
+            'text': 'message text from the local user',
+            'sender': '0',
+            'clock': {str(i): history + i % 3 for i in range(process_count)},
+            'id': '{}_0'.format(history),
+        }),
+    ]
+
+
+def bench_codecs(args):
+    workloads = {
+        'kv-replication': _kv_messages(),
+        'broadcast': _broadcast_messages(args.processes, args.history),
+    }
+    rows = []
+    for workload, messages in workloads.items():
+        for name in args.codecs or available_codecs():
+            codec = get_codec(name)
+            payloads = [codec.encode(msg._data) for msg in messages]
+            size = sum(len(payload) for payload in payloads) / len(payloads)
+            encode_rate = ops_per_sec(lambda: [codec.encode(msg._data) for msg in messages], args.count)
+            decode_rate = ops_per_sec(lambda: [codec.decode(payload) for payload in payloads], args.count)
+            rows.append([
+                workload, name, '{:.0f}'.format(size),
+                '{:.0f}'.format(encode_rate * len(messages)), '{:.0f}'.format(decode_rate * len(messages)),
+            ])
+    print_table(['workload', 'codec', 'bytes/msg', 'encode msg/s', 'decode msg/s'], rows)
+
+
+def add_codecs_args(parser: argparse.ArgumentParser):
+    parser.add_argument('--codec', dest='codecs', action='append', help='codec to measure (default: all registered)')
+    parser.add_argument('--count', type=int, default=100000, help='number of iterations')
+    parser.add_argument('--processes', type=int, default=10, help='number of processes in broadcast ids')
+    parser.add_argument('--history', type=int, default=30, help='messages of every sender in broadcast vector clocks')
+
+
+# FORWARD --------------------------------------------------------------------------------------------------------------
+
+def bench_forward(args):
+    payload = get_codec(args.codec).encode(_broadcast_messages(args.processes, args.history)[0]._data)
+    peers = [str(i) for i in range(args.processes - 1)]
+    ctx = Context(0, get_codec(args.codec))
+
+    def relay(lazy: bool):
+        msg = Message.decode('BCAST', payload, lazy)
+        msg['id']
+        for peer in peers:
+            ctx.send(msg, peer)
+        ctx._sent_messages.clear()
+
+    rows = []
+    for lazy in [False, True]:
+        rate = ops_per_sec(lambda: relay(lazy), args.count)
+        rows.append(['lazy' if lazy else 'eager', '{:.0f}'.format(rate)])
+    print_table(['message', 'relays/s'], rows)
+
+
+def add_forward_args(parser: argparse.ArgumentParser):
+    parser.add_argument('--codec', default='json', help='codec of the relayed payload')
+    parser.add_argument('--count', type=int, default=20000, help='number of relayed messages')
+    parser.add_argument('--processes', type=int, default=10, help='number of processes, each relay sends to all but one')
+    parser.add_argument('--history', type=int, default=30, help='messages of every sender in broadcast vector clocks')
@@ -0,0 +1,71 @@
+"""
+Sharded simulation compared to the single-threaded one.
+"""
+import argparse
+import os
+import time
+from typing import Any, Dict, List
+
+from dslabmp import Message
+from sharded import ShardedSimulation
+from simulator import Simulation, load_process_class
+
+from .common import HOMEWORK_DIR, print_table
+
+
+def _run_membership(sim, nodes: List[str], duration: float) -> Dict[str, Any]:
+    for node_id in nodes:
+        sim.send_local_message(node_id, Message('JOIN', {'seed': nodes[0]}))
+    start = time.perf_counter()
+    events = sim.run(until=duration)
+    elapsed = time.perf_counter() - start
+    stats = {'events': events, 'elapsed': elapsed}
+    if isinstance(sim, ShardedSimulation):
+        stats.update(windows=sim.window_count(), critical=sim.critical_time())
+    for node_id in nodes:
+        sim.send_local_message(node_id, Message('GET_MEMBERS', {}))
+    sim.run(until=duration)
+    stats['members'] = {node_id: sorted(sim.read_local_messages(node_id)[-1]['members']) for node_id in nodes}
+    return stats
+
+
+def bench_sharded(args):
+    nodes = [str(i) for i in range(args.nodes)]
+    runs = {}
+    if not args.skip_single:
+        sim = Simulation(args.seed, isolate_random=True)
+        sim.network.set_delays(args.min_delay, args.max_delay)
+        node_class = load_process_class(args.impl, 'GroupMember')
+        for node_id in nodes:
+            sim.add_process(node_id, node_class(node_id))
+        runs['single'] = _run_membership(sim, nodes, args.duration)
+    for workers in args.workers or [2, 4]:
+        with ShardedSimulation(workers, args.seed) as sim:
+            sim.network.set_delays(args.min_delay, args.max_delay)
+            for node_id in nodes:
+                sim.add_process(node_id, args.impl, 'GroupMember')
+            runs['{} workers'.format(workers)] = _run_membership(sim, nodes, args.duration)
+    reference = runs.get('single')
+    rows = []
+    for name, run in runs.items():
+        rows.append([
+            name, run['events'], '{:.2f}'.format(run['elapsed']), '{:.0f}'.format(run['events'] / run['elapsed']),
+            run.get('windows', '-'), '-' if 'critical' not in run else '{:.2f}'.format(run['critical']),
+            '{:.1f}'.format(sum(len(members) for members in run['members'].values()) / len(nodes)),
+            '-' if reference is None else 'yes' if run['members'] == reference['members'] else 'NO',
+        ])
+    # critical s is the run time with a core per worker and free communication, compare it with the single run
+    print_table(['run', 'events', 'time s', 'events/s', 'windows', 'critical s', 'avg members', 'same as single'],
+                 rows)
+
+
+def add_sharded_args(parser: argparse.ArgumentParser):
+    parser.add_argument('--impl', default=os.path.join(HOMEWORK_DIR, '06-membership', 'solution.py'),
+                        help='path to solution with GroupMember class')
+    parser.add_argument('--nodes', type=int, default=1000, help='number of group members')
+    parser.add_argument('--duration', type=float, default=3, help='simulated time')
+    parser.add_argument('--workers', type=int, action='append', help='number of workers (default: 2 and 4)')
+    parser.add_argument('--min-delay', type=float, default=0.01, help='minimal message delay')
+    parser.add_argument('--max-delay', type=float, default=0.1, help='maximal message delay')
+    parser.add_argument('--skip-single', action='store_true', help='do not run the single-threaded simulation')
+    parser.add_argument('--seed', type=int, default=123, help='random seed')
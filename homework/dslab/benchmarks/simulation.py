@@ -0,0 +1,74 @@
+"""
+Simulator throughput on a key-value storage.
+"""
+import argparse
+import os
+import random
+
+from dslabmp import Message, get_codec
+from profiler import Profiler
+from simulator import Simulation, load_process_class
+
+from .common import HOMEWORK_DIR, print_table
+
+
+def bench_sim(args):
+    node_class = load_process_class(args.impl, 'StorageNode')
+    rows = []
+    # a profiler per run, so the reports of eager and lazy messages are not mixed
+    profilers = {}
+    for lazy in [False, True]:
+        mode = 'lazy' if lazy else 'eager'
+        profiler = profilers[mode] = Profiler(trace=bool(args.trace)) if args.profile or args.trace else None
+        sim = Simulation(args.seed, get_codec(args.codec), lazy_messages=lazy, profiler=profiler)
+        sim.network.set_delays(0.01, 0.1)
+        nodes = [str(i) for i in range(args.nodes)]
+        for node_id in nodes:
+            sim.add_process(node_id, node_class(node_id, nodes))
+        rand = random.Random(args.seed)
+        stats = {'events': 0, 'elapsed': 0.}
+        for chunk_start in range(0, args.ops, args.chunk):
+            for i in range(chunk_start, min(chunk_start + args.chunk, args.ops)):
+                key = 'key-{}'.format(rand.randrange(args.keys))
+                if rand.random() < args.put_rate:
+                    msg = Message('PUT', {'key': key, 'value': 'value-{}'.format(i), 'quorum': args.quorum})
+                else:
+                    msg = Message('GET', {'key': key, 'quorum': args.quorum})
+                sim.send_local_message(rand.choice(nodes), msg, (i - chunk_start) * args.interval)
+            result = sim.benchmark(until=sim.time() + args.chunk * args.interval)
+            stats['events'] += result['events']
+            stats['elapsed'] += result['elapsed']
+        result = sim.benchmark()
+        stats['events'] += result['events']
+        stats['elapsed'] += result['elapsed']
+        responses = sum(len(sim.read_local_messages(node_id)) for node_id in nodes)
+        rows.append([
+            mode, args.ops, responses, stats['events'], sim.network_message_count(),
+            '{:.2f}'.format(stats['elapsed']), '{:.0f}'.format(stats['events'] / stats['elapsed']),
+        ])
+    print_table(['messages', 'ops', 'responses', 'events', 'net messages', 'time s', 'events/s'], rows)
+    for mode, profiler in profilers.items():
+        if args.profile:
+            print()
+            print('{} messages:'.format(mode))
+            print(profiler.report(args.profile_rows))
+        if args.trace:
+            root, ext = os.path.splitext(args.trace)
+            profiler.save('{}-{}{}'.format(root, mode, ext))
+
+
+def add_sim_args(parser: argparse.ArgumentParser):
+    parser.add_argument('--impl', default=os.path.join(HOMEWORK_DIR, '08-kv-replication', 'solution.py'),
+                        help='path to solution with StorageNode class')
+    parser.add_argument('--nodes', type=int, default=6, help='number of nodes')
+    parser.add_argument('--ops', type=int, default=20000, help='number of client operations, e.g. 1000000')
+    parser.add_argument('--keys', type=int, default=1000, help='number of distinct keys')
+    parser.add_argument('--put-rate', type=float, default=0.5, help='share of PUT operations')
+    parser.add_argument('--quorum', type=int, default=2, help='quorum of operations')
+    parser.add_argument('--interval', type=float, default=0.01, help='time between operations')
+    parser.add_argument('--chunk', type=int, default=1000, help='operations scheduled at once')
+    parser.add_argument('--codec', default='json', help='message codec')
+    parser.add_argument('--seed', type=int, default=123, help='random seed')
+    parser.add_argument('--profile', action='store_true', help='print per-handler profile')
+    parser.add_argument('--profile-rows', type=int, default=20, help='number of rows in the profile')
+    parser.add_argument('--trace', help='path to save Chrome traces of handler calls, suffixed with -eager and -lazy')
@@ -0,0 +1,53 @@
+"""
+Process state snapshots.
+"""
+import argparse
+import os
+
+from dslabmp import TrackedDict
+from simulator import load_process_class
+
+from .common import HOMEWORK_DIR, ops_per_sec, print_table
+
+
+def bench_snapshots(args):
+    node_class = load_process_class(args.impl, 'StorageNode')
+    formats = {
+        'json': (lambda node: node.get_state(), lambda node, state: node.set_state(state)),
+        'binary': (lambda node: node.get_state_bytes(), lambda node, state: node.set_state_bytes(state)),
+        'binary+zlib': (lambda node: node.get_state_bytes('zlib'), lambda node, state: node.set_state_bytes(state)),
+    }
+    rows = []
+    for tracked in [False, True]:
+        for format_name, (get_state, set_state) in formats.items():
+            mapping = TrackedDict if tracked else dict
+            node = node_class('0', [str(i) for i in range(args.nodes)])
+            node._data = mapping(('key-{}'.format(i), 'value-{}'.format(i)) for i in range(args.keys))
+            node._operations_times = mapping(('key-{}'.format(i), float(i)) for i in range(args.keys))
+            get_state(node)
+            step = [0]
+
+            def put_and_snapshot():
+                key = 'key-{}'.format(step[0] % args.keys)
+                step[0] += 1
+                node._data[key] = 'updated-{}'.format(step[0])
+                node._operations_times[key] = float(args.keys + step[0])
+                return get_state(node)
+
+            get_rate = ops_per_sec(put_and_snapshot, args.count)
+            state = put_and_snapshot()
+            set_rate = ops_per_sec(lambda: set_state(node, state), args.count)
+            digest_rate = ops_per_sec(node.state_digest, args.count)
+            rows.append([
+                'TrackedDict' if tracked else 'dict', format_name, '{:.1f}'.format(len(state) / 2 ** 20),
+                '{:.2f}'.format(1000 / get_rate), '{:.2f}'.format(1000 / set_rate), '{:.2f}'.format(1000 / digest_rate),
+            ])
+    print_table(['_data', 'format', 'size MiB', 'put+snapshot ms', 'restore ms', 'state_digest ms'], rows)
+
+
+def add_snapshots_args(parser: argparse.ArgumentParser):
+    parser.add_argument('--impl', default=os.path.join(HOMEWORK_DIR, '08-kv-replication', 'solution.py'),
+                        help='path to solution with StorageNode class')
+    parser.add_argument('--keys', type=int, default=100000, help='number of keys stored in the node')
+    parser.add_argument('--nodes', type=int, default=6, help='number of nodes in the system')
+    parser.add_argument('--count', type=int, default=20, help='number of snapshots')
@@ -1,11 +1,150 @@
 from __future__ import annotations
 import abc
+import hashlib
+import io
 import json
+import marshal
+import os
 import pickle
-from typing import Any, Dict, List, Tuple, Union
+import struct
+import weakref
+import zlib
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
 
 
 JSON = Union[Dict[str, "JSON"], List["JSON"], str, int, float, bool, None]
+Payload = Union[str, bytes]
+
+
+class Codec:
+    """
+    Converts message data to the payload transferred over the network and back.
+
+    Text payloads are always JSON. Binary codecs prefix their payloads with a one-byte tag,
+    so the receiving side can pick the right codec without any out-of-band agreement.
+    """
+    name = ''
+    tag = b''
+
+    @abc.abstractmethod
+    def encode(self, data: Dict[str, Any]) -> Payload:
+        """
+        Encodes message data into a payload.
+        """
+
+    @abc.abstractmethod
+    def decode(self, payload: Payload) -> Dict[str, Any]:
+        """
+        Decodes message data from a payload produced by encode().
+        """
+
+
+class JsonCodec(Codec):
+    """
+    The default codec, compatible with the dslab-mp runtime.
+    """
+    name = 'json'
+
+    def encode(self, data: Dict[str, Any]) -> str:
+        return json.dumps(data)
+
+    def decode(self, payload: str) -> Dict[str, Any]:
+        return json.loads(payload)
+
+
+class MarshalCodec(Codec):
+    """
+    Compact binary codec built on the marshal module.
+
+    Payloads are readable only by the same Python version, so this codec is meant for simulations
+    running entirely in Python. Unlike JSON it keeps tuples and non-string dict keys as is.
+    """
+    name = 'marshal'
+    tag = b'\x01'
+
+    def encode(self, data: Dict[str, Any]) -> bytes:
+        return self.tag + marshal.dumps(data)
+
+    def decode(self, payload: bytes) -> Dict[str, Any]:
+        return marshal.loads(memoryview(payload)[1:])
+
+
+class MsgpackCodec(Codec):
+    """
+    Portable binary codec, available when the msgpack package is installed.
+    """
+    name = 'msgpack'
+    tag = b'\x02'
+
+    def encode(self, data: Dict[str, Any]) -> bytes:
+        return self.tag + msgpack.packb(data)
+
+    def decode(self, payload: bytes) -> Dict[str, Any]:
+        return msgpack.unpackb(memoryview(payload)[1:], strict_map_key=False)
+
+
+JSON_CODEC = JsonCodec()
+_CODECS_BY_NAME: Dict[str, Codec] = {}
+_CODECS_BY_TAG: Dict[int, Codec] = {}
+
+
+def register_codec(codec: Codec):
+    """
+    Makes the codec available via get_codec() and for decoding of tagged payloads.
+    """
+    if codec.tag:
+        if len(codec.tag) != 1:
+            raise ValueError('codec tag has to be a single byte')
+        other = _CODECS_BY_TAG.get(codec.tag[0])
+        if other is not None and other.name != codec.name:
+            raise ValueError('codec tag {!r} is already used by {}'.format(codec.tag, other.name))
+        _CODECS_BY_TAG[codec.tag[0]] = codec
+    _CODECS_BY_NAME[codec.name] = codec
+
+
+def get_codec(name: str) -> Codec:
+    """
+    Returns the registered codec with the specified name.
+    """
+    try:
+        return _CODECS_BY_NAME[name]
+    except KeyError:
+        raise ValueError('unknown codec {!r}, available: {}'.format(name, ', '.join(sorted(_CODECS_BY_NAME))))
+
+
+def available_codecs() -> List[str]:
+    """
+    Returns the names of all registered codecs.
+    """
+    return sorted(_CODECS_BY_NAME)
+
+
+def codec_for_payload(payload: Payload) -> Codec:
+    """
+    Returns the codec that produced the payload.
+    """
+    if isinstance(payload, str):
+        return JSON_CODEC
+    try:
+        return _CODECS_BY_TAG[payload[0]]
+    except (IndexError, KeyError):
+        raise ValueError('payload is not produced by any registered codec')
+
+
+register_codec(JSON_CODEC)
+register_codec(MarshalCodec())
+if msgpack is not None:
+    register_codec(MsgpackCodec())
 
 
 class Message:
@@ -20,22 +159,104 @@ class Message:
     def __getitem__(self, key: str) -> Any:
         return self._data[key]
 
+    def peek(self, key: str) -> Any:
+        """
+        Returns the field value for reading only: a container it returns must not be changed,
+        so that a LazyMessage stays unmodified and is forwarded with its original payload.
+        """
+        return self._data[key]
+
     def __setitem__(self, key: str, value: Any):
         self._data[key] = value
 
     def remove(self, key: str):
         self._data.pop(key, None)
 
+    def encode(self, codec: Codec = JSON_CODEC) -> Payload:
+        """
+        Returns the message data encoded with the specified codec.
+        """
+        return codec.encode(self._data)
+
     @staticmethod
     def from_json(message_type: str, json_str: str) -> Message:
         return Message(message_type, json.loads(json_str))
 
+    @staticmethod
+    def decode(message_type: str, payload: Payload, lazy: bool = False) -> Message:
+        """
+        Builds a message from a payload produced by any registered codec.
+        If lazy is set, the payload is decoded only when a field is accessed, see LazyMessage.
+        """
+        if lazy:
+            return LazyMessage(message_type, payload)
+        return Message(message_type, codec_for_payload(payload).decode(payload))
+
+
+_SCALAR_TYPES = (str, int, float, bool, bytes, type(None))
+
+
+class LazyMessage(Message):
+    """
+    Message that keeps the received payload and decodes it on the first field access.
+
+    As long as the message is not modified, encode() with the same codec returns the original payload,
+    so forwarding a message does not re-encode it. Reading a field that holds a container counts as
+    a modification, since the caller may change it in place, unless the field is read with peek().
+    """
+
+    def __init__(self, message_type: str, payload: Payload):
+        self._type = message_type
+        self._payload = payload
+        self._codec = codec_for_payload(payload)
+        self._decoded: Union[Dict[str, Any], None] = None
+        self._pristine = True
+
+    @property
+    def _data(self) -> Dict[str, Any]:
+        if self._decoded is None:
+            self._decoded = self._codec.decode(self._payload)
+        return self._decoded
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._data[key]
+        if not isinstance(value, _SCALAR_TYPES):
+            self._pristine = False
+        return value
+
+    def __setitem__(self, key: str, value: Any):
+        self._data[key] = value
+        self._pristine = False
+
+    def remove(self, key: str):
+        self._data.pop(key, None)
+        self._pristine = False
+
+    def encode(self, codec: Codec = JSON_CODEC) -> Payload:
+        if self._pristine and codec.name == self._codec.name:
+            return self._payload
+        return codec.encode(self._data)
+
+    def __getstate__(self):
+        if self._pristine:
+            return self._type, self._payload, None
+        return self._type, None, self._data
+
+    def __setstate__(self, state):
+        self._type, self._payload, self._decoded = state
+        self._pristine = self._payload is not None
+        if self._pristine:
+            self._codec = codec_for_payload(self._payload)
+        else:
+            self._codec = JSON_CODEC
+
 
 class Context(object):
-    def __init__(self, time: float):
+    def __init__(self, time: float, codec: Codec = JSON_CODEC):
         self._time = time
-        self._sent_messages: List[Tuple[str, str, str]] = list()
-        self._sent_local_messages: List[tuple[str, str]] = list()
+        self._codec = codec
+        self._sent_messages: List[Tuple[str, Payload, str]] = list()
+        self._sent_local_messages: List[tuple[str, Payload]] = list()
         self._timer_actions: List[Tuple[str, float, bool]] = list()
 
     def send(self, msg: Message, to: str):
@@ -46,7 +267,34 @@ class Context(object):
             raise ValueError('message type length exceeds the limit of 50 characters')
         if not isinstance(to, str):
             raise TypeError('to argument has to be string, not {}'.format(type(to)))
-        self._sent_messages.append((msg.type, json.dumps(msg._data), to))
+        self._sent_messages.append((msg.type, msg.encode(self._codec), to))
+
+    def send_many(self, msg: Message, to: Iterable[str]):
+        """
+        Sends a message to each of the specified processes.
+        The message is encoded once and all copies share the same payload.
+        """
+        if len(msg.type) > 50:
+            raise ValueError('message type length exceeds the limit of 50 characters')
+        payload = msg.encode(self._codec)
+        for proc in to:
+            if not isinstance(proc, str):
+                raise TypeError('to argument has to contain strings, not {}'.format(type(proc)))
+            self._sent_messages.append((msg.type, payload, proc))
+
+    def drain_batches(self) -> Dict[str, List[Tuple[str, Payload]]]:
+        """
+        Returns the sent messages grouped by destination as (type, payload) lists in the order of sending,
+        so that each destination can receive them in one batch. The sent messages are cleared.
+        """
+        batches: Dict[str, List[Tuple[str, Payload]]] = {}
+        for message_type, payload, to in self._sent_messages:
+            batch = batches.get(to)
+            if batch is None:
+                batch = batches[to] = []
+            batch.append((message_type, payload))
+        self._sent_messages.clear()
+        return batches
 
     def send_local(self, msg: Message):
         """
@@ -54,7 +302,7 @@ class Context(object):
         """
         if len(msg.type) > 50:
             raise ValueError('message type length exceeds the limit of 50 characters')
-        self._sent_local_messages.append((msg.type, json.dumps(msg._data)))
+        self._sent_local_messages.append((msg.type, msg.encode(self._codec)))
 
     def set_timer(self, timer_name: str, delay: float):
         """
@@ -102,6 +350,13 @@ class Context(object):
 
 
 class Process:
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # see profiler.py, handlers are wrapped only when profiling is enabled
+        if os.environ.get('DSLABMP_PROFILE'):
+            import profiler
+            profiler.profile_class(cls, profiler.env_profiler(os.environ['DSLABMP_PROFILE']))
+
     @abc.abstractmethod
     def on_local_message(self, msg: Message, ctx: Context):
         """
@@ -123,18 +378,374 @@ class Process:
     def get_state(self) -> str:
         """
         This method returns the string representation of process state.
+        It is the JSON form of get_state_bytes() used by the dslab-mp runtime.
         """
-        data = {}
-        for name, member in self.__dict__.items():
-            data[name] = bytes.hex(pickle.dumps(member))
-        return json.dumps(data)
+        # hex strings need no escaping, so the JSON is assembled directly instead of scanning them in json.dumps
+        parts = []
+        for name, member, entries in _snapshot_members(self):
+            parts.append(', ' if parts else '{')
+            parts.append(json.dumps(name))
+            if entries is not None:
+                parts += [': {"tracked": "', entries.hex_encoded(), '"}']
+            else:
+                parts += [': "', bytes.hex(pickle.dumps(member)), '"']
+        parts.append('}' if parts else '{}')
+        return ''.join(parts)
 
     def set_state(self, state_encoded: str):
         """
         This method restores the process state by its string representation.
         """
-        data = json.loads(state_encoded)
-        for name in self.__dict__:
-            self.__dict__[name] = None
-        for name, member in data.items():
-            self.__dict__[name] = pickle.loads(bytes.fromhex(member))
+        members = []
+        for name, member in json.loads(state_encoded).items():
+            if isinstance(member, dict):
+                members.append((name, STATE_TRACKED, member['tracked']))
+            else:
+                members.append((name, STATE_PICKLE, bytes.fromhex(member)))
+        _restore_members(self, members)
+
+    def get_state_bytes(self, compression: Union[str, None] = None) -> bytes:
+        """
+        This method returns the binary representation of process state, see pack_state().
+        """
+        members = []
+        for name, member, entries in _snapshot_members(self):
+            if entries is not None:
+                members.append((name, STATE_TRACKED, entries.packed()))
+            else:
+                members.append((name, STATE_PICKLE, pickle.dumps(member)))
+        return pack_state(members, compression)
+
+    def set_state_bytes(self, state: bytes):
+        """
+        This method restores the process state by its binary representation.
+        """
+        _restore_members(self, unpack_state(state))
+
+    def state_digest(self) -> str:
+        """
+        This method returns a hash of process state, which can be used to detect already seen states.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for name, member, entries in sorted(_snapshot_members(self), key=lambda item: item[0]):
+            digest.update(name.encode())
+            if entries is not None:
+                digest.update(entries.digest.to_bytes(16, 'little'))
+            else:
+                digest.update(hashlib.blake2b(pickle.dumps(member), digest_size=16).digest())
+        return digest.hexdigest()
+
+
+# Binary state format: header followed by the (optionally compressed) body of member records.
+# Header: magic, format version, compression id, body length.
+# Member record: name length, kind, payload length, name, payload.
+# STATE_PICKLE payload is the pickled member, STATE_TRACKED payload is a sequence of
+# TrackedDict entries, each one is the varint length followed by the pickled (key, value) pair
+# without the protocol, frame and stop opcodes shared by all entries.
+STATE_MAGIC = b'DSMP'
+STATE_VERSION = 2
+STATE_PICKLE = 0
+STATE_TRACKED = 1
+_STATE_HEADER = struct.Struct('<4sBBI')
+_STATE_MEMBER = struct.Struct('<HBI')
+_ENTRY_PROTOCOL = 4
+_ENTRY_PREFIX = pickle.PROTO + bytes([_ENTRY_PROTOCOL])
+# entries of these types can have neither shared nor cyclic references, so they are pickled without the memo
+_ATOMIC_TYPES = frozenset([str, bytes, int, float, bool, type(None)])
+
+# name -> (id, compress, decompress)
+STATE_COMPRESSIONS = {
+    None: (0, None, None),
+    'zlib': (1, lambda data: zlib.compress(data, 1), zlib.decompress),
+}
+if lz4 is not None:
+    STATE_COMPRESSIONS['lz4'] = (2, lz4.frame.compress, lz4.frame.decompress)
+_DECOMPRESSORS = {compression_id: decompress for compression_id, _, decompress in STATE_COMPRESSIONS.values()}
+
+StateMember = Tuple[str, int, Union[bytes, memoryview, str]]
+
+
+def pack_state(members: Iterable[StateMember], compression: Union[str, None] = None) -> bytes:
+    """
+    Packs (name, kind, payload) members into a single length-prefixed buffer.
+    """
+    if compression not in STATE_COMPRESSIONS:
+        raise ValueError('unknown compression {!r}, available: {}'.format(
+            compression, ', '.join(str(name) for name in STATE_COMPRESSIONS)))
+    compression_id, compress, _ = STATE_COMPRESSIONS[compression]
+    parts = []
+    for name, kind, payload in members:
+        name_encoded = name.encode()
+        parts += [_STATE_MEMBER.pack(len(name_encoded), kind, len(payload)), name_encoded, payload]
+    body = b''.join(parts)
+    if compress is not None:
+        body = compress(body)
+    return _STATE_HEADER.pack(STATE_MAGIC, STATE_VERSION, compression_id, len(body)) + body
+
+
+def unpack_state(state: bytes) -> List[StateMember]:
+    """
+    Unpacks the buffer produced by pack_state(). Payloads are returned as memoryview slices of the buffer.
+    """
+    view = memoryview(state)
+    magic, version, compression_id, length = _STATE_HEADER.unpack_from(view)
+    if magic != STATE_MAGIC or version != STATE_VERSION:
+        raise ValueError('unsupported state format')
+    if compression_id not in _DECOMPRESSORS:
+        raise ValueError('state is compressed with unavailable compression {}'.format(compression_id))
+    body = view[_STATE_HEADER.size:_STATE_HEADER.size + length]
+    if len(body) != length:
+        raise ValueError('state is truncated')
+    decompress = _DECOMPRESSORS[compression_id]
+    if decompress is not None:
+        body = memoryview(decompress(body))
+    members = []
+    offset = 0
+    while offset < len(body):
+        name_length, kind, payload_length = _STATE_MEMBER.unpack_from(body, offset)
+        offset += _STATE_MEMBER.size
+        name = str(body[offset:offset + name_length], 'utf-8')
+        offset += name_length
+        members.append((name, kind, body[offset:offset + payload_length]))
+        offset += payload_length
+    return members
+
+
+def _restore_members(proc: Process, members: List[StateMember]):
+    cache = _snapshot_caches.get(proc, {})
+    for name in proc.__dict__:
+        proc.__dict__[name] = None
+    restored_cache = {}
+    for name, kind, payload in members:
+        if kind == STATE_TRACKED:
+            entries = cache.get(name) or _TrackedEntries(TrackedDict())
+            if isinstance(payload, str):
+                entries.restore_hex(payload)
+            else:
+                entries.restore_packed(payload)
+            restored_cache[name] = entries
+            proc.__dict__[name] = entries.source
+        else:
+            proc.__dict__[name] = pickle.loads(payload)
+    _snapshot_caches[proc] = restored_cache
+
+
+class TrackedDict(dict):
+    """
+    Dict that remembers changed keys, so that process state snapshots re-serialize only the changed entries.
+
+    Changes are noticed when a key is assigned or removed. A value modified in place has to be assigned again.
+    Key order is not part of the snapshot and may change when the state is restored.
+    """
+    __slots__ = ('_dirty', '_reset')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._dirty = set()
+        self._reset = True
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._dirty.add(key)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._dirty.add(key)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __reduce__(self):
+        return TrackedDict, (dict(self),)
+
+    def pop(self, key, *default):
+        self._dirty.add(key)
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        self._dirty.add(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        dict.clear(self)
+        self._dirty.clear()
+        self._reset = True
+
+
+def _encode_entry(key, value) -> bytes:
+    if type(key) in _ATOMIC_TYPES and type(value) in _ATOMIC_TYPES:
+        buffer = io.BytesIO()
+        pickler = pickle.Pickler(buffer, _ENTRY_PROTOCOL)
+        pickler.fast = True
+        pickler.dump((key, value))
+        raw = buffer.getvalue()
+    else:
+        raw = pickle.dumps((key, value), _ENTRY_PROTOCOL)
+    body = raw[len(_ENTRY_PREFIX):-1]
+    if body[:1] == pickle.FRAME:
+        body = body[9:]
+    length = len(body)
+    header = bytearray()
+    while length >= 0x80:
+        header.append(length & 0x7f | 0x80)
+        length >>= 7
+    header.append(length)
+    return bytes(header) + body
+
+
+def _entry_end(view: memoryview, offset: int) -> Tuple[int, int]:
+    """
+    Returns the offsets of the body and of the end of the entry starting at offset.
+    """
+    length, shift = 0, 0
+    while True:
+        byte = view[offset]
+        offset += 1
+        length |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return offset, offset + length
+        shift += 7
+
+
+def _decode_entry(entry: bytes) -> tuple:
+    start, _ = _entry_end(memoryview(entry), 0)
+    return pickle.loads(_ENTRY_PREFIX + entry[start:] + pickle.STOP)
+
+
+class _TrackedEntries:
+    """
+    Snapshot of a TrackedDict: every entry is kept as the compact pickle of (key, value) pair with its hash.
+    The digest is the order-independent sum of entry hashes.
+    """
+    __slots__ = ('source', 'keys', 'by_entry', 'digest', '_packed', '_hex')
+
+    def __init__(self, source: TrackedDict):
+        self.source = source
+        self.keys: Dict[Any, Tuple[bytes, int]] = {}
+        self.by_entry: Dict[bytes, Any] = {}
+        self.digest = 0
+        self._packed: Union[bytes, None] = b''
+        self._hex: Union[str, None] = ''
+
+    def packed(self) -> bytes:
+        self.refresh()
+        if self._packed is None:
+            self._packed = b''.join(self.by_entry)
+        return self._packed
+
+    def hex_encoded(self) -> str:
+        if self._hex is None or self.source._dirty or self.source._reset:
+            self._hex = self.packed().hex()
+        return self._hex
+
+    def refresh(self):
+        """
+        Re-encodes the entries changed in the source since the last call.
+        """
+        source = self.source
+        if source._reset:
+            self._clear()
+            keys = list(source)
+            source._reset = False
+        else:
+            keys = source._dirty
+        for key in keys:
+            self._discard(key)
+            if key in source:
+                self._add(key, _encode_entry(key, dict.__getitem__(source, key)))
+        source._dirty.clear()
+
+    def restore_hex(self, encoded: str):
+        """
+        Brings the source to the snapshot in hex_encoded() form.
+        """
+        if self.hex_encoded() != encoded:
+            self.restore_packed(bytes.fromhex(encoded))
+            self._hex = encoded
+
+    def restore_packed(self, packed: Union[bytes, memoryview]):
+        """
+        Brings the source to the snapshot in packed() form.
+        """
+        current = self.packed()
+        # comparing a memoryview goes item by item, bytes are compared with memcmp
+        if len(current) == len(packed) and current == bytes(packed):
+            return
+        view = memoryview(packed)
+        entries = set()
+        offset = 0
+        while offset < len(view):
+            _, end = _entry_end(view, offset)
+            entries.add(bytes(view[offset:end]))
+            offset = end
+        self._restore(entries)
+
+    def _restore(self, incoming: set):
+        # only the entries that differ from the current state of the source are decoded
+        self.refresh()
+        source = self.source
+        for entry in self.by_entry.keys() - incoming:
+            key = self.by_entry[entry]
+            dict.__delitem__(source, key)
+            self._discard(key)
+        for entry in incoming - self.by_entry.keys():
+            key, value = _decode_entry(entry)
+            dict.__setitem__(source, key, value)
+            self._add(key, entry)
+
+    def _add(self, key, entry: bytes):
+        entry_hash = int.from_bytes(hashlib.blake2b(entry, digest_size=16).digest(), 'little')
+        self.keys[key] = (entry, entry_hash)
+        self.by_entry[entry] = key
+        self.digest = (self.digest + entry_hash) % _DIGEST_MODULUS
+        self._packed = self._hex = None
+
+    def _discard(self, key):
+        entry = self.keys.pop(key, None)
+        if entry is not None:
+            del self.by_entry[entry[0]]
+            self.digest = (self.digest - entry[1]) % _DIGEST_MODULUS
+            self._packed = self._hex = None
+
+    def _clear(self):
+        self.keys.clear()
+        self.by_entry.clear()
+        self.digest = 0
+        self._packed = b''
+        self._hex = ''
+
+
+_DIGEST_MODULUS = 1 << 128
+
+# process -> {attribute name -> snapshot of TrackedDict attribute}
+_snapshot_caches: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def _snapshot_members(proc: Process) -> List[Tuple[str, Any, Union[_TrackedEntries, None]]]:
+    cache = _snapshot_caches.get(proc)
+    if cache is None:
+        cache = _snapshot_caches[proc] = {}
+    members = []
+    for name, member in proc.__dict__.items():
+        entries = None
+        if isinstance(member, TrackedDict):
+            entries = cache.get(name)
+            if entries is None or entries.source is not member:
+                member._reset = True
+                entries = cache[name] = _TrackedEntries(member)
+            entries.refresh()
+        else:
+            cache.pop(name, None)
+        members.append((name, member, entries))
+    return members
@@ -0,0 +1,371 @@
+"""
+Model checker that explores executions of dslabmp processes in Python, on several worker processes.
+
+A system state consists of the process states taken with get_state(), the pending events (messages in flight
+and active timers) and the local messages sent by the processes. Every pending event gives a transition:
+a message is delivered, dropped or duplicated, a timer fires. States are identified by digests, the set of
+visited digests is kept by the coordinator, and the workers expand batches of states with set_state().
+
+Predicates follow dslab-mp model checking: the invariant returns an error or None, states matching the goal
+or the prune are not explored further. Predicates receive McState, helpers for the common ones are below.
+
+Digests ignore counters, while prunes such as counter_limit depend on them, so a state is explored again when
+it is reached with counters not dominated by the ones it was reached with before. Prunes are expected to be
+monotone in the counters: a state with larger counters is pruned whenever the same state with smaller ones is.
+"""
+import hashlib
+import multiprocessing
+import random
+import time
+from collections import deque
+from typing import Callable, Dict, List, Tuple, Union
+
+from dslabmp import Context, Message, Process
+
+# event kinds, events are tuples (kind, process, ...)
+MESSAGE = 'message'
+TIMER = 'timer'
+
+# counters of McState
+SENT = 0
+RECEIVED = 1
+DROPPED = 2
+DUPLICATED = 3
+TIMERS_FIRED = 4
+
+STRATEGIES = ('bfs', 'dfs', 'random')
+
+
+class McState:
+    """
+    State of the system. Events are (MESSAGE, dst, src, type, payload) and (TIMER, proc, name, delay).
+    """
+    __slots__ = ('proc_ids', 'proc_states', 'events', 'outboxes', 'time', 'depth', 'counters')
+
+    def __init__(self, proc_ids: Tuple[str, ...], proc_states: Tuple[str, ...], events: Tuple[tuple, ...],
+                 outboxes: Tuple[Tuple[Tuple[str, str], ...], ...], time: float, depth: int, counters: Tuple[int, ...]):
+        self.proc_ids = proc_ids
+        self.proc_states = proc_states
+        self.events = events
+        self.outboxes = outboxes
+        self.time = time
+        self.depth = depth
+        self.counters = counters
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def digest(self) -> bytes:
+        """
+        Identifies the state by process states, pending events and local messages, ignoring time and counters.
+        """
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(repr((self.proc_states, sorted(self.events), self.outboxes)).encode())
+        return hasher.digest()
+
+    def local_outbox(self, proc_id: str) -> List[Message]:
+        return [Message.decode(message_type, payload) for message_type, payload in
+                self.outboxes[self.proc_ids.index(proc_id)]]
+
+    def sent_messages(self) -> int:
+        return self.counters[SENT]
+
+    def received_messages(self) -> int:
+        return self.counters[RECEIVED]
+
+    def dropped_messages(self) -> int:
+        return self.counters[DROPPED]
+
+    def duplicated_messages(self) -> int:
+        return self.counters[DUPLICATED]
+
+    def timers_fired(self) -> int:
+        return self.counters[TIMERS_FIRED]
+
+
+# PREDICATES -----------------------------------------------------------------------------------------------------------
+
+def got_n_local_messages(proc_id: str, count: int) -> Callable[[McState], bool]:
+    return lambda state: len(state.outboxes[state.proc_ids.index(proc_id)]) >= count
+
+
+def no_events() -> Callable[[McState], bool]:
+    return lambda state: not state.events
+
+
+def any_of(predicates: List[Callable[[McState], bool]]) -> Callable[[McState], bool]:
+    return lambda state: any(predicate(state) for predicate in predicates)
+
+
+def all_of(predicates: List[Callable[[McState], bool]]) -> Callable[[McState], bool]:
+    return lambda state: all(predicate(state) for predicate in predicates)
+
+
+def counter_limit(counter: int, limit: int) -> Callable[[McState], bool]:
+    """
+    Prune of states where the counter, e.g. DROPPED, exceeds the limit.
+    """
+    return lambda state: state.counters[counter] > limit
+
+
+def state_depth(depth: int) -> Callable[[McState], Union[str, None]]:
+    """
+    Invariant failing on states deeper than depth.
+    """
+    return lambda state: 'state depth exceeds {}'.format(depth) if state.depth > depth else None
+
+
+def all_invariants(invariants: List[Callable[[McState], Union[str, None]]]) -> Callable[[McState], Union[str, None]]:
+    def check(state: McState) -> Union[str, None]:
+        for invariant in invariants:
+            error = invariant(state)
+            if error is not None:
+                return error
+        return None
+    return check
+
+
+# CHECKER --------------------------------------------------------------------------------------------------------------
+
+class ModelChecker:
+    """
+    Explores the states reachable from the initial processes after the initial local messages.
+
+    make_processes creates the processes, it is called once in every worker. Messages can be dropped and
+    duplicated if drops and duplications are enabled, timers can fire at any moment; time advances by the delay
+    of the fired timer. Workers are forked, so the predicates and make_processes may be closures.
+    """
+
+    def __init__(self, make_processes: Callable[[], Dict[str, Process]],
+                 invariant: Union[Callable[[McState], Union[str, None]], None] = None,
+                 goal: Union[Callable[[McState], bool], None] = None,
+                 prune: Union[Callable[[McState], bool], None] = None,
+                 drops: bool = False, duplications: bool = False):
+        self._make_processes = make_processes
+        self._invariant = invariant or (lambda state: None)
+        self._goal = goal or (lambda state: False)
+        self._prune = prune or (lambda state: False)
+        self._drops = drops
+        self._duplications = duplications
+        self._processes: Dict[str, Process] = {}
+
+    def run(self, initial_messages: List[Tuple[str, Message]], strategy: str = 'bfs', workers: int = 1,
+            batch_size: int = 64, max_states: Union[int, None] = None, walks: int = 1000, walk_depth: int = 50,
+            seed: int = 123) -> Dict[str, object]:
+        """
+        Runs the search and returns its statistics and the first invariant violation, if any.
+        The random strategy makes walks of at most walk_depth steps, the other ones explore all states,
+        at most max_states of them.
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError('unknown strategy {!r}, expected one of {}'.format(strategy, ', '.join(STRATEGIES)))
+        start = time.perf_counter()
+        initial = self._initial_state(initial_messages)
+        result = {'strategy': strategy, 'workers': workers, 'states': 1, 'unique_states': 1, 'goals': 0,
+                  'max_depth': 0, 'error': None, 'error_state': None}
+        self._check(initial, result)
+        if result['error'] is None and not self._goal(initial) and not self._prune(initial):
+            pool = multiprocessing.get_context('fork').Pool(workers, _init_worker, (self,)) if workers > 1 else None
+            try:
+                if strategy == 'random':
+                    self._random_walks(initial, result, pool, walks, walk_depth, seed)
+                else:
+                    self._search(initial, result, pool, strategy, batch_size, max_states)
+            finally:
+                if pool is not None:
+                    pool.terminate()
+        result['elapsed'] = time.perf_counter() - start
+        result['states_per_sec'] = result['states'] / result['elapsed'] if result['elapsed'] > 0 else 0.
+        return result
+
+    # SEARCH -----------------------------------------------------------------------------------------------------------
+
+    def _search(self, initial: McState, result: dict, pool, strategy: str, batch_size: int,
+                max_states: Union[int, None]):
+        # digest -> counters the state was reached with, none of them dominates another
+        visited = {initial.digest(): [initial.counters]}
+        frontier = deque([initial])
+        while frontier and result['error'] is None:
+            if max_states is not None and result['unique_states'] >= max_states:
+                break
+            # bfs takes the oldest states, dfs the newest ones
+            take = frontier.popleft if strategy == 'bfs' else frontier.pop
+            batch = [take() for _ in range(min(len(frontier), batch_size * max(1, _pool_size(pool))))]
+            for children in self._map(pool, _expand_batch, batch):
+                for digest, child, status in children:
+                    result['states'] += 1
+                    seen = visited.get(digest)
+                    if seen is None:
+                        visited[digest] = [child.counters]
+                        result['unique_states'] += 1
+                    elif any(_dominates(counters, child.counters) for counters in seen):
+                        continue
+                    else:
+                        seen[:] = [counters for counters in seen if not _dominates(child.counters, counters)]
+                        seen.append(child.counters)
+                    result['max_depth'] = max(result['max_depth'], child.depth)
+                    if status == 'goal':
+                        result['goals'] += seen is None
+                    elif status == 'explore':
+                        frontier.append(child)
+                    elif status != 'prune' and result['error'] is None:
+                        result['error'], result['error_state'] = status, child
+
+    def _random_walks(self, initial: McState, result: dict, pool, walks: int, walk_depth: int, seed: int):
+        visited = {initial.digest()}
+        tasks = [(initial, walk_depth, seed * 1000003 + walk) for walk in range(walks)]
+        for steps, digests, goal, error, error_state in self._map(pool, _walk, tasks):
+            result['states'] += steps
+            before = len(visited)
+            visited.update(digests)
+            result['unique_states'] += len(visited) - before
+            result['max_depth'] = max(result['max_depth'], steps)
+            result['goals'] += goal
+            if error is not None and result['error'] is None:
+                result['error'], result['error_state'] = error, error_state
+
+    def _map(self, pool, fn, items: list) -> list:
+        if pool is None:
+            global _worker_checker
+            _worker_checker = self
+            return [fn(items)] if fn is _expand_batch else [fn(item) for item in items]
+        if fn is _expand_batch:
+            size = -(-len(items) // _pool_size(pool))
+            return pool.map(fn, [items[i:i + size] for i in range(0, len(items), size)])
+        return pool.map(fn, items, chunksize=max(1, len(items) // (4 * _pool_size(pool))))
+
+    # TRANSITIONS ------------------------------------------------------------------------------------------------------
+
+    def _initial_state(self, initial_messages: List[Tuple[str, Message]]) -> McState:
+        self._processes = self._make_processes()
+        proc_ids = tuple(self._processes)
+        state = McState(proc_ids, tuple(proc.get_state() for proc in self._processes.values()), (),
+                        tuple(() for _ in proc_ids), 0., 0, (0, 0, 0, 0, 0))
+        for proc_id, msg in initial_messages:
+            state = self._apply(state, proc_id, 'on_local_message', (msg,), list(state.events), None)
+            state.depth = 0
+        return state
+
+    def _check(self, state: McState, result: dict):
+        error = self._invariant(state)
+        if error is not None:
+            result['error'], result['error_state'] = error, state
+
+    def _status(self, state: McState) -> str:
+        error = self._invariant(state)
+        if error is not None:
+            return error
+        if self._goal(state):
+            return 'goal'
+        if self._prune(state):
+            return 'prune'
+        return 'explore'
+
+    def _successors(self, state: McState) -> List[McState]:
+        successors = []
+        for event in sorted(set(state.events)):
+            events = list(state.events)
+            events.remove(event)
+            if event[0] == MESSAGE:
+                _, dst, src, message_type, payload = event
+                msg = Message.decode(message_type, payload)
+                successors.append(self._apply(state, dst, 'on_message', (msg, src), events, RECEIVED))
+                if self._duplications:
+                    msg = Message.decode(message_type, payload)
+                    successors.append(self._apply(state, dst, 'on_message', (msg, src), events + [event], DUPLICATED))
+                if self._drops:
+                    successors.append(McState(state.proc_ids, state.proc_states, tuple(events), state.outboxes,
+                                              state.time, state.depth + 1, _increment(state.counters, DROPPED)))
+            else:
+                _, proc_id, name, delay = event
+                fired = McState(state.proc_ids, state.proc_states, state.events, state.outboxes,
+                                state.time + delay, state.depth, state.counters)
+                successors.append(self._apply(fired, proc_id, 'on_timer', (name,), events, TIMERS_FIRED))
+        return successors
+
+    def _apply(self, state: McState, proc_id: str, handler: str, args: tuple, events: List[tuple],
+               counter: Union[int, None]) -> McState:
+        events = list(events)
+        index = state.proc_ids.index(proc_id)
+        proc = self._processes[proc_id]
+        proc.set_state(state.proc_states[index])
+        ctx = Context(state.time)
+        getattr(proc, handler)(*args, ctx)
+        proc_states = list(state.proc_states)
+        proc_states[index] = proc.get_state()
+        counters = list(state.counters)
+        if counter is not None:
+            counters[counter] += 1
+        counters[SENT] += len(ctx._sent_messages)
+        for message_type, payload, to in ctx._sent_messages:
+            events.append((MESSAGE, to, proc_id, message_type, payload))
+        for name, delay, once in ctx._timer_actions:
+            active = [event for event in events if event[0] == TIMER and event[1] == proc_id and event[2] == name]
+            if once and active:
+                continue
+            for event in active:
+                events.remove(event)
+            if delay >= 0:
+                events.append((TIMER, proc_id, name, delay))
+        outboxes = state.outboxes
+        if ctx._sent_local_messages:
+            outboxes = list(outboxes)
+            outboxes[index] = outboxes[index] + tuple(ctx._sent_local_messages)
+            outboxes = tuple(outboxes)
+        return McState(state.proc_ids, tuple(proc_states), tuple(sorted(events)), outboxes, state.time,
+                       state.depth + 1, tuple(counters))
+
+
+def _dominates(counters: Tuple[int, ...], other: Tuple[int, ...]) -> bool:
+    return all(value <= other_value for value, other_value in zip(counters, other))
+
+
+def _increment(counters: Tuple[int, ...], counter: int) -> Tuple[int, ...]:
+    return counters[:counter] + (counters[counter] + 1,) + counters[counter + 1:]
+
+
+def _pool_size(pool) -> int:
+    return pool._processes if pool is not None else 1
+
+
+# WORKERS --------------------------------------------------------------------------------------------------------------
+
+_worker_checker: Union[ModelChecker, None] = None
+
+
+def _init_worker(checker: ModelChecker):
+    global _worker_checker
+    _worker_checker = checker
+    checker._processes = checker._make_processes()
+
+
+def _expand_batch(states: List[McState]) -> List[Tuple[bytes, McState, str]]:
+    children = []
+    for state in states:
+        for child in _worker_checker._successors(state):
+            children.append((child.digest(), child, _worker_checker._status(child)))
+    return children
+
+
+def _walk(task: Tuple[McState, int, int]) -> Tuple[int, List[bytes], int, Union[str, None], Union[McState, None]]:
+    state, depth, seed = task
+    rand = random.Random(seed)
+    digests = []
+    for step in range(depth):
+        successors = _worker_checker._successors(state)
+        if not successors:
+            return step, digests, 0, None, None
+        state = rand.choice(successors)
+        digests.append(state.digest())
+        status = _worker_checker._status(state)
+        if status == 'goal':
+            return step + 1, digests, 1, None, None
+        if status == 'prune':
+            return step + 1, digests, 0, None, None
+        if status != 'explore':
+            return step + 1, digests, 0, status, state
+    return depth, digests, 0, None, None
@@ -0,0 +1,194 @@
+"""
+Per-handler profiling of dslabmp processes.
+
+Profiler measures calls of on_message, on_local_message and on_timer per handler and message type (or timer
+name): call count, wall time with a latency histogram, messages and bytes sent and allocated memory blocks.
+The results are printed as a flat report or saved as a Chrome trace, viewable in chrome://tracing or Perfetto.
+
+Profiling is attached either by passing the profiler to simulator.Simulation, or, for the dslab-mp runtime,
+by setting DSLABMP_PROFILE to the output path: process classes are then wrapped when they are defined and the
+results are written at exit, as a Chrome trace if the path ends with .json and as a flat report otherwise.
+Nothing is wrapped when profiling is not enabled, so there is no overhead.
+"""
+import atexit
+import functools
+import json
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+HANDLERS = ('on_message', 'on_local_message', 'on_timer')
+
+# histogram bucket i counts calls that took less than 2^i microseconds
+HISTOGRAM_BUCKETS = 24
+
+
+class HandlerStats:
+    __slots__ = ('calls', 'total', 'max', 'histogram', 'messages_sent', 'bytes_sent', 'allocated_blocks')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.
+        self.max = 0.
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.allocated_blocks = 0
+
+    def percentile(self, share: float) -> float:
+        """
+        Returns the upper bound in seconds of the histogram bucket holding the given share of calls.
+        """
+        threshold = share * self.calls
+        seen = 0
+        for bucket, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= threshold:
+                return (1 << bucket) / 1e6
+        return self.max
+
+
+class Profiler:
+    """
+    Collects handler statistics, and with trace enabled also a timeline of at most max_trace_events calls.
+    Allocations are the net number of memory blocks allocated by the interpreter during the call.
+    """
+
+    def __init__(self, trace: bool = False, max_trace_events: int = 1000000):
+        self._trace = trace
+        self._max_trace_events = max_trace_events
+        self._stats: Dict[Tuple[str, str], HandlerStats] = {}
+        self._events: List[tuple] = []
+        self._start = time.perf_counter()
+
+    def call(self, proc_id: str, handler: Callable, key: str, ctx: Any, *args: Any):
+        """
+        Calls the handler with args and ctx, recording the call under (class and handler name, key).
+        The class is the one of the process the handler is bound to.
+        """
+        sent_before = len(ctx._sent_messages)
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        try:
+            return handler(*args, ctx)
+        finally:
+            elapsed = time.perf_counter() - start
+            stat_key = (_handler_name(handler), key)
+            stats = self._stats.get(stat_key)
+            if stats is None:
+                stats = self._stats[stat_key] = HandlerStats()
+            stats.calls += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            stats.histogram[min(int(elapsed * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+            sent = ctx._sent_messages[sent_before:]
+            stats.messages_sent += len(sent)
+            stats.bytes_sent += sum(len(message_type) + len(payload) for message_type, payload, _ in sent)
+            stats.allocated_blocks += sys.getallocatedblocks() - blocks
+            if self._trace and len(self._events) < self._max_trace_events:
+                self._events.append((proc_id, stat_key, start, elapsed, ctx.time(), len(sent)))
+
+    def stats(self) -> Dict[Tuple[str, str], HandlerStats]:
+        return dict(self._stats)
+
+    def report(self, limit: Union[int, None] = None) -> str:
+        """
+        Returns the flat report with a row per handler and key, sorted by total time, at most limit rows.
+        """
+        header = ['handler', 'key', 'calls', 'total ms', 'avg us', 'p50 us', 'p99 us', 'max us',
+                  'msgs sent', 'bytes sent', 'alloc blocks']
+        rows = []
+        for (handler, key), stats in sorted(self._stats.items(), key=lambda item: -item[1].total)[:limit]:
+            rows.append([
+                handler, key, stats.calls, '{:.1f}'.format(stats.total * 1e3),
+                '{:.1f}'.format(stats.total / stats.calls * 1e6), '<{:.0f}'.format(stats.percentile(0.5) * 1e6),
+                '<{:.0f}'.format(stats.percentile(0.99) * 1e6), '{:.0f}'.format(stats.max * 1e6),
+                stats.messages_sent, stats.bytes_sent, stats.allocated_blocks,
+            ])
+        widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+        return '\n'.join(
+            '  '.join(str(cell).ljust(width) for cell, width in zip(row, widths)).rstrip() for row in [header] + rows
+        )
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        """
+        Returns recorded calls in the Chrome trace event format, a thread per process.
+        """
+        events = []
+        for proc_id, (handler, key), start, elapsed, sim_time, sent in self._events:
+            events.append({
+                'name': '{} {}'.format(handler, key), 'cat': handler, 'ph': 'X', 'pid': 0, 'tid': proc_id,
+                'ts': (start - self._start) * 1e6, 'dur': elapsed * 1e6,
+                'args': {'time': sim_time, 'messages sent': sent},
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, path: str):
+        """
+        Writes the Chrome trace if the path ends with .json and the flat report otherwise.
+        """
+        with open(path, 'w') as output:
+            if path.endswith('.json'):
+                json.dump(self.chrome_trace(), output)
+            else:
+                output.write(self.report() + '\n')
+
+
+def profile_class(cls: type, profiler: Profiler):
+    """
+    Wraps the handlers of the process class, so that all their calls are recorded by the profiler.
+    Only the outermost call is recorded: handlers called through super() run inside it.
+    """
+    for name in HANDLERS:
+        handler = cls.__dict__.get(name)
+        if handler is None or getattr(handler, '_profiled', False):
+            continue
+        if name == 'on_timer':
+            def wrapper(self, timer_name, ctx, _handler=handler):
+                return _profiled_call(profiler, self, _handler, timer_name, ctx, timer_name)
+        elif name == 'on_message':
+            def wrapper(self, msg, sender, ctx, _handler=handler):
+                return _profiled_call(profiler, self, _handler, msg.type, ctx, msg, sender)
+        else:
+            def wrapper(self, msg, ctx, _handler=handler):
+                return _profiled_call(profiler, self, _handler, msg.type, ctx, msg)
+        wrapper = functools.wraps(handler)(wrapper)
+        wrapper._profiled = True
+        setattr(cls, name, wrapper)
+
+
+# ids of processes inside a profiled handler call, kept outside the processes so that it is not part of their state
+_active_processes = set()
+
+
+def _profiled_call(profiler: Profiler, proc: Any, handler: Callable, key: str, ctx: Any, *args: Any):
+    if id(proc) in _active_processes:
+        return handler(proc, *args, ctx)
+    _active_processes.add(id(proc))
+    try:
+        return profiler.call(_proc_name(proc), handler.__get__(proc), key, ctx, *args)
+    finally:
+        _active_processes.discard(id(proc))
+
+
+def _handler_name(handler: Callable) -> str:
+    owner = getattr(handler, '__self__', None)
+    return handler.__name__ if owner is None else '{}.{}'.format(type(owner).__name__, handler.__name__)
+
+
+def _proc_name(proc: Any) -> str:
+    return str(getattr(proc, '_id', None) or '{}@{:x}'.format(type(proc).__name__, id(proc)))
+
+
+_env_profiler = None
+
+
+def env_profiler(path: str) -> Profiler:
+    """
+    Returns the profiler enabled by DSLABMP_PROFILE, creating it and registering its output on the first call.
+    """
+    global _env_profiler
+    if _env_profiler is None:
+        _env_profiler = Profiler(trace=path.endswith('.json'))
+        atexit.register(_env_profiler.save, path)
+    return _env_profiler
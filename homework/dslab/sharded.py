@@ -0,0 +1,305 @@
+"""
+Sharded simulation: processes of one Simulation are partitioned across worker processes.
+
+The workers advance in conservative time windows. A message sent at time t arrives not earlier than
+t + network.min_delay, so when the earliest pending event of the whole system is at time T, every worker can
+process its events before T + min_delay without waiting for the others: nothing sent in the window can
+arrive inside it. After the window the workers exchange the messages they sent to each other's processes.
+
+Events are ordered exactly as in the single-threaded Simulation and every process has its own random
+streams, so a sharded run produces the same results as Simulation with the same seed and isolate_random set.
+
+Every window costs a round trip to each active worker and pickling of the events crossing shards, so sharding
+pays off only with a core per worker and enough events per worker in a window: many processes per shard and
+a min_delay that is not much shorter than the typical delay. With fewer cores than workers, or with windows
+of a few events, a sharded run is slower than the single-threaded one.
+"""
+import heapq
+import multiprocessing
+import os
+import time
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+from dslabmp import Codec, JSON_CODEC, Message
+from simulator import LOCAL_MESSAGE, MESSAGE, USER, Network, Simulation, load_process_class
+
+INFINITY = float('inf')
+
+
+class _Shard(Simulation):
+    """
+    Simulation of a part of the processes, run inside a worker.
+    Messages to processes of other shards are collected in the outbox instead of the event queue.
+    """
+
+    def __init__(self, seed: int, codec: Codec, lazy_messages: bool):
+        super().__init__(seed, codec, lazy_messages, isolate_random=True)
+        self._outbox: List[tuple] = []
+
+    def add_remote_process(self, proc_id: str):
+        self._addresses.add(proc_id)
+
+    def next_time(self) -> float:
+        return self._events[0][0] if self._events else INFINITY
+
+    def run_window(self, end: float, inclusive: bool) -> int:
+        """
+        Processes events with time before end, or not later than end if inclusive is set.
+        """
+        done = 0
+        events = self._events
+        while events and (events[0][0] < end or inclusive and events[0][0] == end):
+            if self._dispatch(heapq.heappop(events)):
+                done += 1
+        return done
+
+    def drain_outbox(self) -> List[tuple]:
+        outbox = self._outbox
+        self._outbox = []
+        return outbox
+
+    def drain_local_messages(self) -> Dict[str, List[Tuple[float, Message]]]:
+        drained = {}
+        for proc_id, messages in self._local_messages.items():
+            if messages:
+                drained[proc_id] = messages
+                self._local_messages[proc_id] = []
+        return drained
+
+    def _schedule(self, event: tuple):
+        if event[3] == MESSAGE and event[5] not in self._processes:
+            self._outbox.append(event)
+        else:
+            heapq.heappush(self._events, event)
+
+
+def _run_worker(conn, seed: int, codec: Codec, lazy_messages: bool, specs: List[tuple], addresses: List[str]):
+    shard = _Shard(seed, codec, lazy_messages)
+    classes = {}
+    for proc_id, path, class_name, args in specs:
+        if (path, class_name) not in classes:
+            classes[(path, class_name)] = load_process_class(path, class_name)
+        shard.add_process(proc_id, classes[(path, class_name)](proc_id, *args))
+    for proc_id in addresses:
+        shard.add_remote_process(proc_id)
+    while True:
+        command = conn.recv()
+        if command[0] == 'stop':
+            break
+        _, end, inclusive, events, crashed, network = command
+        shard.network = network
+        for proc_id in crashed:
+            shard.crash_process(proc_id)
+        for event in events:
+            heapq.heappush(shard._events, event)
+        # CPU time of the worker, so that workers sharing a core do not count each other's time
+        start = time.process_time()
+        done = shard.run_window(end, inclusive)
+        elapsed = time.process_time() - start
+        conn.send((
+            done, elapsed, shard.time(), shard.drain_outbox(), shard.next_time(), shard.drain_local_messages(),
+            shard.network_message_count(), shard.traffic(),
+        ))
+    conn.close()
+
+
+class ShardedSimulation:
+    """
+    Runs processes in simulated time on several worker processes.
+
+    Processes are created inside the workers, so they are specified by the path to the solution, the class name
+    and the constructor arguments following the process id. The partition function maps a process id and
+    its index in the order of add_process() calls to a worker, by default processes are assigned round-robin.
+    The global random module is always isolated per process, see Simulation.
+    """
+
+    def __init__(self, workers: Union[int, None] = None, seed: int = 123, codec: Codec = JSON_CODEC,
+                 lazy_messages: bool = False, partition: Union[Callable[[str, int], int], None] = None):
+        self.network = Network()
+        self._workers = workers or os.cpu_count() or 1
+        self._seed = seed
+        self._codec = codec
+        self._lazy = lazy_messages
+        self._partition = partition or (lambda proc_id, index: index % self._workers)
+        self._specs: List[List[tuple]] = [[] for _ in range(self._workers)]
+        self._shard_of: Dict[str, int] = {}
+        self._conns = []
+        self._pool = []
+        self._time = 0.
+        self._user_seq = 0
+        self._event_count = 0
+        self._window_count = 0
+        self._critical_time = 0.
+        self._inboxes: List[List[tuple]] = [[] for _ in range(self._workers)]
+        self._crashed: List[List[str]] = [[] for _ in range(self._workers)]
+        self._next_times = [INFINITY] * self._workers
+        self._local_messages: Dict[str, List[Tuple[float, Message]]] = {}
+        self._message_counts = [0] * self._workers
+        self._traffic = [0] * self._workers
+
+    def __enter__(self) -> 'ShardedSimulation':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # SETUP ------------------------------------------------------------------------------------------------------------
+
+    def add_process(self, proc_id: str, path: str, class_name: str, *args: Any):
+        """
+        Adds the process created as class_name(proc_id, *args) from the class defined in the file at path.
+        Processes can only be added before the first run.
+        """
+        if self._pool:
+            raise RuntimeError('processes can not be added after the simulation has started')
+        if proc_id == USER or proc_id in self._shard_of:
+            raise ValueError('process id {!r} is empty or already used'.format(proc_id))
+        shard = self._partition(proc_id, len(self._shard_of))
+        if not 0 <= shard < self._workers:
+            raise ValueError('partition returned worker {} out of range'.format(shard))
+        self._shard_of[proc_id] = shard
+        self._specs[shard].append((proc_id, path, class_name, args))
+        self._local_messages[proc_id] = []
+
+    def process_ids(self) -> List[str]:
+        return list(self._shard_of)
+
+    def shard_of(self, proc_id: str) -> int:
+        return self._shard_of[proc_id]
+
+    def crash_process(self, proc_id: str):
+        """
+        Stops the process: its pending events are discarded and messages sent to it are lost.
+        """
+        self._crashed[self._shard_of[proc_id]].append(proc_id)
+
+    def close(self):
+        for conn in self._conns:
+            conn.send(('stop',))
+            conn.close()
+        for worker in self._pool:
+            worker.join()
+        self._conns = []
+
+    # INTERACTION ------------------------------------------------------------------------------------------------------
+
+    def send_local_message(self, proc_id: str, msg: Message, delay: float = 0.):
+        """
+        Schedules delivery of the local message to the process.
+        """
+        self._user_seq += 1
+        self._inboxes[self._shard_of[proc_id]].append(
+            (self._time + delay, USER, self._user_seq, LOCAL_MESSAGE, proc_id, msg.type, msg.encode(self._codec)))
+
+    def read_local_messages(self, proc_id: str) -> List[Message]:
+        """
+        Returns local messages sent by the process since the last call.
+        """
+        messages = [msg for _, msg in self._local_messages[proc_id]]
+        self._local_messages[proc_id] = []
+        return messages
+
+    def local_messages(self, proc_id: str) -> List[Tuple[float, Message]]:
+        """
+        Returns (time, message) for local messages sent by the process since the last read_local_messages().
+        """
+        return list(self._local_messages[proc_id])
+
+    # EXECUTION --------------------------------------------------------------------------------------------------------
+
+    def time(self) -> float:
+        return self._time
+
+    def event_count(self) -> int:
+        return self._event_count
+
+    def window_count(self) -> int:
+        return self._window_count
+
+    def critical_time(self) -> float:
+        """
+        Returns the sum over windows of the longest CPU time a worker spent processing events in the window,
+        the lower bound of the run time if every worker had its own core and communication was free.
+        """
+        return self._critical_time
+
+    def network_message_count(self) -> int:
+        return sum(self._message_counts)
+
+    def traffic(self) -> int:
+        return sum(self._traffic)
+
+    def step_until_no_events(self) -> int:
+        return self.run()
+
+    def step_for_duration(self, duration: float) -> int:
+        return self.run(until=self._time + duration)
+
+    def run(self, until: Union[float, None] = None) -> int:
+        """
+        Processes events with time not later than until. Returns the number of processed events.
+        """
+        self._start()
+        limit = INFINITY if until is None else until
+        done = 0
+        while True:
+            next_times = [
+                min([self._next_times[shard]] + [event[0] for event in self._inboxes[shard]])
+                for shard in range(self._workers)
+            ]
+            start = min(next_times)
+            if start > limit or start == INFINITY:
+                break
+            end = start + self.network.min_delay
+            inclusive = end > limit
+            if inclusive:
+                end = limit
+            active = [
+                shard for shard in range(self._workers)
+                if next_times[shard] < end or inclusive and next_times[shard] == end or self._crashed[shard]
+            ]
+            for shard in active:
+                self._conns[shard].send(
+                    ('run', end, inclusive, self._inboxes[shard], self._crashed[shard], self.network))
+                self._inboxes[shard] = []
+                self._crashed[shard] = []
+            window_time = 0.
+            for shard in active:
+                reply = self._conns[shard].recv()
+                count, elapsed, last_time, outbox, next_time, local_messages, message_count, traffic = reply
+                done += count
+                window_time = max(window_time, elapsed)
+                self._time = max(self._time, last_time)
+                self._next_times[shard] = next_time
+                self._message_counts[shard] = message_count
+                self._traffic[shard] = traffic
+                for event in outbox:
+                    self._inboxes[self._shard_of[event[5]]].append(event)
+                for proc_id, messages in local_messages.items():
+                    self._local_messages[proc_id] += messages
+            self._window_count += 1
+            self._critical_time += window_time
+        if until is not None and until > self._time:
+            self._time = until
+        self._event_count += done
+        return done
+
+    # INTERNALS --------------------------------------------------------------------------------------------------------
+
+    def _start(self):
+        if self._pool:
+            if not self._conns:
+                raise RuntimeError('the simulation is closed')
+            return
+        addresses = list(self._shard_of)
+        for shard in range(self._workers):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(
+                target=_run_worker,
+                args=(child_conn, self._seed, self._codec, self._lazy, self._specs[shard], addresses),
+                daemon=True,
+            )
+            worker.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._pool.append(worker)
@@ -0,0 +1,316 @@
+"""
+Discrete-event simulator that runs dslabmp processes directly in Python.
+
+It mirrors the dslab-mp System used by the tests: processes exchange messages over a network with
+configurable delays, drops and duplications, and timers and local messages behave as in dslab-mp.
+The runs are deterministic for a given seed: every process has its own random streams, and events with
+equal time are ordered by their origin, not by the order they were scheduled in.
+"""
+import heapq
+import importlib.util
+import os
+import random
+import time
+from typing import Dict, List, Tuple, Union
+
+from dslabmp import Codec, Context, JSON_CODEC, Message, Payload, Process
+from profiler import Profiler
+
+# event kinds, events are heap tuples (time, origin, origin_seq, kind, ...)
+LOCAL_MESSAGE = 0
+MESSAGE = 1
+TIMER = 2
+
+# origin of the local messages sent by the simulation user
+USER = ''
+
+
+def load_process_class(path: str, class_name: str) -> type:
+    """
+    Loads the process class from the Python file, like dslab-mp PyProcessFactory does.
+    """
+    spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(path))[0], path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, class_name)
+
+
+class Network:
+    """
+    Network model: message delay is uniform in [min_delay, max_delay], a message is dropped with drop_rate
+    and duplicated with dupl_rate. The copy of a duplicated message gets its own delay.
+    """
+
+    def __init__(self, min_delay: float = 1., max_delay: float = 1., drop_rate: float = 0., dupl_rate: float = 0.):
+        self.set_delays(min_delay, max_delay)
+        self.set_drop_rate(drop_rate)
+        self.set_dupl_rate(dupl_rate)
+
+    def set_delay(self, delay: float):
+        self.set_delays(delay, delay)
+
+    def set_delays(self, min_delay: float, max_delay: float):
+        if not 0 < min_delay <= max_delay:
+            raise ValueError('delays have to satisfy 0 < min_delay <= max_delay')
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+
+    def set_drop_rate(self, drop_rate: float):
+        if not 0 <= drop_rate <= 1:
+            raise ValueError('drop_rate has to be in [0, 1]')
+        self.drop_rate = drop_rate
+
+    def set_dupl_rate(self, dupl_rate: float):
+        if not 0 <= dupl_rate <= 1:
+            raise ValueError('dupl_rate has to be in [0, 1]')
+        self.dupl_rate = dupl_rate
+
+
+class Simulation:
+    """
+    Runs processes in simulated time.
+
+    Processes that use the global random module get it seeded with the simulation seed. If isolate_random
+    is set, it is switched to a per-process state around every handler call instead, so that the processes
+    stay deterministic however their events interleave. This costs a few microseconds per event.
+    If lazy_messages is set, handlers receive LazyMessage objects.
+    If profiler is specified, it records all handler calls.
+    """
+
+    def __init__(self, seed: int = 123, codec: Codec = JSON_CODEC, lazy_messages: bool = False,
+                 isolate_random: bool = False, profiler: Union[Profiler, None] = None):
+        self.network = Network()
+        self._seed = seed
+        self._codec = codec
+        self._lazy = lazy_messages
+        self._isolate_random = isolate_random
+        self._profiler = profiler
+        self._time = 0.
+        self._events: List[tuple] = []
+        self._event_count = 0
+        self._processes: Dict[str, Process] = {}
+        # ids messages can be sent to
+        self._addresses = set()
+        self._crashed = set()
+        # per-process streams: network decisions on sent messages and the global random module state
+        self._net_random: Dict[str, random.Random] = {}
+        self._proc_random: Dict[str, tuple] = {}
+        # origin -> number of events it has scheduled, used to order simultaneous events
+        self._origin_seq: Dict[str, int] = {USER: 0}
+        # (process, timer name) -> (generation, deadline) of active timers
+        self._timers: Dict[Tuple[str, str], Tuple[int, float]] = {}
+        self._local_messages: Dict[str, List[Tuple[float, Message]]] = {}
+        self._sent_counts: Dict[str, int] = {}
+        self._network_message_count = 0
+        self._traffic = 0
+        if not isolate_random:
+            random.seed(seed)
+
+    # SETUP ------------------------------------------------------------------------------------------------------------
+
+    def add_process(self, proc_id: str, proc: Process):
+        if proc_id == USER or proc_id in self._processes:
+            raise ValueError('process id {!r} is empty or already used'.format(proc_id))
+        self._processes[proc_id] = proc
+        self._addresses.add(proc_id)
+        self._net_random[proc_id] = random.Random('{}:net:{}'.format(self._seed, proc_id))
+        self._proc_random[proc_id] = random.Random('{}:proc:{}'.format(self._seed, proc_id)).getstate()
+        self._origin_seq[proc_id] = 0
+        self._local_messages[proc_id] = []
+        self._sent_counts[proc_id] = 0
+
+    def process(self, proc_id: str) -> Process:
+        return self._processes[proc_id]
+
+    def process_ids(self) -> List[str]:
+        return list(self._processes)
+
+    def crash_process(self, proc_id: str):
+        """
+        Stops the process: its pending events are discarded and messages sent to it are lost.
+        """
+        self._crashed.add(proc_id)
+        for key in [key for key in self._timers if key[0] == proc_id]:
+            del self._timers[key]
+
+    # INTERACTION ------------------------------------------------------------------------------------------------------
+
+    def send_local_message(self, proc_id: str, msg: Message, delay: float = 0.):
+        """
+        Schedules delivery of the local message to the process.
+        """
+        self._push(self._time + delay, USER, LOCAL_MESSAGE, proc_id, msg.type, msg.encode(self._codec))
+
+    def read_local_messages(self, proc_id: str) -> List[Message]:
+        """
+        Returns local messages sent by the process since the last call.
+        """
+        messages = [msg for _, msg in self._local_messages[proc_id]]
+        self._local_messages[proc_id] = []
+        return messages
+
+    def local_messages(self, proc_id: str) -> List[Tuple[float, Message]]:
+        """
+        Returns (time, message) for local messages sent by the process since the last read_local_messages().
+        """
+        return list(self._local_messages[proc_id])
+
+    # EXECUTION --------------------------------------------------------------------------------------------------------
+
+    def time(self) -> float:
+        return self._time
+
+    def event_count(self) -> int:
+        return self._event_count
+
+    def has_events(self) -> bool:
+        return bool(self._events)
+
+    def step(self) -> bool:
+        """
+        Processes the next event. Returns False if there are no events.
+        """
+        while self._events:
+            event = heapq.heappop(self._events)
+            if self._dispatch(event):
+                return True
+        return False
+
+    def steps(self, count: int) -> int:
+        done = 0
+        while done < count and self.step():
+            done += 1
+        return done
+
+    def step_until_no_events(self, max_events: Union[int, None] = None) -> int:
+        return self.run(max_events=max_events)
+
+    def step_for_duration(self, duration: float) -> int:
+        return self.run(until=self._time + duration)
+
+    def run(self, until: Union[float, None] = None, max_events: Union[int, None] = None) -> int:
+        """
+        Processes events with time not later than until, at most max_events of them.
+        Returns the number of processed events.
+        """
+        done = 0
+        events = self._events
+        while events and (max_events is None or done < max_events):
+            if until is not None and events[0][0] > until:
+                break
+            if self._dispatch(heapq.heappop(events)):
+                done += 1
+        if until is not None and until > self._time:
+            self._time = until
+        return done
+
+    def benchmark(self, max_events: Union[int, None] = None, until: Union[float, None] = None) -> Dict[str, float]:
+        """
+        Runs the simulation headless and reports its speed.
+        """
+        start = time.perf_counter()
+        events = self.run(until=until, max_events=max_events)
+        elapsed = time.perf_counter() - start
+        return {
+            'events': events,
+            'elapsed': elapsed,
+            'events_per_sec': events / elapsed if elapsed > 0 else 0.,
+            'sim_time': self._time,
+            'messages': self._network_message_count,
+        }
+
+    # STATISTICS -------------------------------------------------------------------------------------------------------
+
+    def sent_message_count(self, proc_id: str) -> int:
+        return self._sent_counts[proc_id]
+
+    def network_message_count(self) -> int:
+        return self._network_message_count
+
+    def traffic(self) -> int:
+        """
+        Returns the total size of message types and payloads sent over the network.
+        """
+        return self._traffic
+
+    # INTERNALS --------------------------------------------------------------------------------------------------------
+
+    def _push(self, event_time: float, origin: str, kind: int, *data):
+        seq = self._origin_seq[origin] + 1
+        self._origin_seq[origin] = seq
+        self._schedule((event_time, origin, seq, kind) + data)
+
+    def _schedule(self, event: tuple):
+        heapq.heappush(self._events, event)
+
+    def _dispatch(self, event: tuple) -> bool:
+        kind = event[3]
+        if kind == TIMER:
+            proc_id, name, generation = event[4:]
+            timer = self._timers.get((proc_id, name))
+            if timer is None or timer[0] != generation:
+                return False
+            del self._timers[(proc_id, name)]
+        else:
+            proc_id = event[4] if kind == LOCAL_MESSAGE else event[5]
+        if proc_id in self._crashed:
+            return False
+        self._time = event[0]
+        self._event_count += 1
+        proc = self._processes[proc_id]
+        if kind == MESSAGE:
+            msg = Message.decode(event[6], event[7], self._lazy)
+            self._call(proc_id, proc.on_message, event[6], msg, event[4])
+        elif kind == LOCAL_MESSAGE:
+            msg = Message.decode(event[5], event[6], self._lazy)
+            self._call(proc_id, proc.on_local_message, event[5], msg)
+        else:
+            self._call(proc_id, proc.on_timer, event[5], event[5])
+        return True
+
+    def _call(self, proc_id: str, handler, key: str, *args):
+        # key is the message type or the timer name, used by the profiler
+        ctx = Context(self._time, self._codec)
+        if self._isolate_random:
+            outer_state = random.getstate()
+            random.setstate(self._proc_random[proc_id])
+        try:
+            if self._profiler is None:
+                handler(*args, ctx)
+            else:
+                self._profiler.call(proc_id, handler, key, ctx, *args)
+        finally:
+            if self._isolate_random:
+                self._proc_random[proc_id] = random.getstate()
+                random.setstate(outer_state)
+        self._apply_actions(proc_id, ctx)
+
+    def _apply_actions(self, proc_id: str, ctx: Context):
+        for message_type, payload in ctx._sent_local_messages:
+            self._local_messages[proc_id].append((self._time, Message.decode(message_type, payload)))
+        for message_type, payload, to in ctx._sent_messages:
+            self._send(proc_id, to, message_type, payload)
+        for name, delay, once in ctx._timer_actions:
+            key = (proc_id, name)
+            if delay < 0:
+                self._timers.pop(key, None)
+            elif not once or key not in self._timers:
+                # the sequence number of the timer event, so stale events of fired or cancelled timers never match
+                generation = self._origin_seq[proc_id] + 1
+                self._timers[key] = (generation, self._time + delay)
+                self._push(self._time + delay, proc_id, TIMER, proc_id, name, generation)
+
+    def _send(self, src: str, dst: str, message_type: str, payload: Payload):
+        if dst not in self._addresses:
+            raise ValueError('process {} sent a message to unknown process {!r}'.format(src, dst))
+        self._sent_counts[src] += 1
+        self._network_message_count += 1
+        self._traffic += len(message_type) + len(payload)
+        net = self.network
+        rand = self._net_random[src]
+        if net.drop_rate and rand.random() < net.drop_rate:
+            return
+        copies = 2 if net.dupl_rate and rand.random() < net.dupl_rate else 1
+        for _ in range(copies):
+            delay = net.min_delay if net.min_delay == net.max_delay else rand.uniform(net.min_delay, net.max_delay)
+            self._push(self._time + delay, src, MESSAGE, src, dst, message_type, payload)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the dslab modules import each other as top-level modules, like the processes run by dslab-mp do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,129 @@
+import pytest
+
+from dslabmp import JSON_CODEC, LazyMessage, Message, Process, TrackedDict, available_codecs, codec_for_payload, \
+    get_codec
+
+DATA = {'text': 'привет', 'id': 42, 'ratio': 0.5, 'ok': True, 'none': None, 'ids': [1, 2, 3],
+        'nested': {'clock': {'a': 1, 'b': 2}, 'path': ['x', 'y']}}
+
+
+@pytest.mark.parametrize('name', available_codecs())
+def test_codec_round_trip(name):
+    codec = get_codec(name)
+    payload = codec.encode(DATA)
+    assert codec_for_payload(payload) is codec
+    assert codec.decode(payload) == DATA
+    assert Message.decode('MSG', payload)['nested'] == DATA['nested']
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        get_codec('no such codec')
+    with pytest.raises(ValueError):
+        codec_for_payload(b'')
+
+
+@pytest.mark.parametrize('name', available_codecs())
+def test_lazy_message_pristine(name):
+    payload = get_codec(name).encode(DATA)
+    msg = Message.decode('MSG', payload, lazy=True)
+    assert isinstance(msg, LazyMessage)
+    assert msg['id'] == 42 and msg['text'] == DATA['text']
+    assert msg.peek('ids') == [1, 2, 3] and msg.peek('nested') == DATA['nested']
+    # scalars and peeked containers keep the original payload
+    assert msg.encode(get_codec(name)) is payload
+
+
+@pytest.mark.parametrize('change', [
+    lambda msg: msg['ids'].append(4),
+    lambda msg: msg.__setitem__('id', 43),
+    lambda msg: msg.remove('none'),
+])
+def test_lazy_message_dirty(change):
+    payload = JSON_CODEC.encode(DATA)
+    msg = Message.decode('MSG', payload, lazy=True)
+    change(msg)
+    encoded = msg.encode()
+    assert encoded is not payload
+    expected = Message('MSG', JSON_CODEC.decode(payload))
+    change(expected)
+    assert JSON_CODEC.decode(encoded) == JSON_CODEC.decode(expected.encode())
+
+
+def test_lazy_message_other_codec():
+    payload = JSON_CODEC.encode(DATA)
+    codec = get_codec('marshal')
+    encoded = Message.decode('MSG', payload, lazy=True).encode(codec)
+    assert codec.decode(encoded) == DATA
+
+
+class Node(Process):
+    def __init__(self):
+        self.items = TrackedDict()
+        self.count = 0
+
+    def on_local_message(self, msg, ctx):
+        pass
+
+    def on_message(self, msg, sender, ctx):
+        pass
+
+    def on_timer(self, timer_name, ctx):
+        pass
+
+
+def _node(items):
+    node = Node()
+    for key, value in items:
+        node.items[key] = value
+    return node
+
+
+def test_tracked_dict_snapshot_restore():
+    node = _node([('k{}'.format(i), i) for i in range(100)])
+    node.count = 7
+    snapshots = [node.get_state_bytes(), node.get_state_bytes('zlib'), node.get_state()]
+    # changes after the snapshots do not leak into them
+    node.items['k0'] = 'changed'
+    del node.items['k1']
+    node.items['new'] = [1, 2]
+    for snapshot in snapshots:
+        restored = Node()
+        if isinstance(snapshot, str):
+            restored.set_state(snapshot)
+        else:
+            restored.set_state_bytes(snapshot)
+        assert isinstance(restored.items, TrackedDict)
+        assert restored.items == {'k{}'.format(i): i for i in range(100)}
+        assert restored.count == 7
+    # an incremental snapshot of the same node after the changes
+    restored = Node()
+    restored.set_state_bytes(node.get_state_bytes())
+    assert restored.items == node.items and restored.items['new'] == [1, 2] and 'k1' not in restored.items
+
+
+def test_tracked_dict_restore_onto_changed_node():
+    node = _node([('a', 1), ('b', 2)])
+    snapshot = node.get_state_bytes()
+    node.items['a'] = 10
+    node.items.pop('b')
+    node.items['c'] = 3
+    node.get_state_bytes()
+    node.set_state_bytes(snapshot)
+    assert node.items == {'a': 1, 'b': 2}
+    node.items.clear()
+    node.set_state_bytes(snapshot)
+    assert node.items == {'a': 1, 'b': 2}
+
+
+def test_tracked_dict_digest():
+    first = _node([('a', 1), ('b', 2)])
+    second = _node([('b', 2), ('a', 1)])
+    # the digest depends on the content, not on the key order
+    assert first.state_digest() == second.state_digest()
+    second.items['a'] = 3
+    assert first.state_digest() != second.state_digest()
+    second.items['a'] = 1
+    assert first.state_digest() == second.state_digest()
+    second.count = 1
+    assert first.state_digest() != second.state_digest()
@@ -0,0 +1,80 @@
+import pytest
+
+from dslabmp import Message, Process
+from modelcheck import DROPPED, DUPLICATED, RECEIVED, ModelChecker, any_of, counter_limit, no_events
+
+
+class Sender(Process):
+    def __init__(self, proc_id, receiver):
+        self._receiver = receiver
+
+    def on_local_message(self, msg, ctx):
+        ctx.send(msg, self._receiver)
+
+    def on_message(self, msg, sender, ctx):
+        pass
+
+    def on_timer(self, timer_name, ctx):
+        pass
+
+
+class Receiver(Process):
+    """
+    Delivers every received message, so a duplicated one is delivered twice.
+    """
+
+    def __init__(self, proc_id):
+        self._delivered = []
+
+    def on_local_message(self, msg, ctx):
+        pass
+
+    def on_message(self, msg, sender, ctx):
+        if self._accept(msg['text']):
+            self._delivered.append(msg['text'])
+            ctx.send_local(msg)
+
+    def on_timer(self, timer_name, ctx):
+        pass
+
+    def _accept(self, text):
+        return True
+
+
+class DedupReceiver(Receiver):
+    def _accept(self, text):
+        return text not in self._delivered
+
+
+def _check(receiver_class, strategy, **options):
+    def invariant(state):
+        delivered = [msg['text'] for msg in state.local_outbox('receiver')]
+        return 'message delivered twice' if len(set(delivered)) != len(delivered) else None
+
+    checker = ModelChecker(
+        lambda: {'sender': Sender('sender', 'receiver'), 'receiver': receiver_class('receiver')},
+        invariant=invariant, goal=no_events(),
+        prune=any_of([counter_limit(DROPPED, 1), counter_limit(DUPLICATED, 1), counter_limit(RECEIVED, 3)]),
+        **options,
+    )
+    initial = [('sender', Message('MESSAGE', {'text': text})) for text in ['a', 'b']]
+    return checker.run(initial, strategy, walks=200, seed=1)
+
+
+@pytest.mark.parametrize('strategy', ['bfs', 'dfs', 'random'])
+def test_finds_seeded_violation(strategy):
+    result = _check(Receiver, strategy, drops=True, duplications=True)
+    assert result['error'] == 'message delivered twice'
+    delivered = [msg['text'] for msg in result['error_state'].local_outbox('receiver')]
+    assert len(delivered) == 2 and delivered[0] == delivered[1]
+
+
+@pytest.mark.parametrize('strategy', ['bfs', 'dfs'])
+def test_no_violation(strategy):
+    result = _check(DedupReceiver, strategy, drops=True, duplications=True)
+    assert result['error'] is None
+    assert result['goals'] > 0 and result['unique_states'] > 1
+
+
+def test_violation_needs_duplications():
+    assert _check(Receiver, 'bfs', drops=True)['error'] is None
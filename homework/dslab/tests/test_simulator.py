@@ -0,0 +1,75 @@
+import random
+
+from dslabmp import Message, Process
+from simulator import Simulation
+
+
+class Gossip(Process):
+    """
+    Forwards every new rumor to random peers and rechecks it on a timer, so the run depends on the random module,
+    the network delays and the order of simultaneous events.
+    """
+
+    def __init__(self, proc_id, peers):
+        self._id = proc_id
+        self._peers = [peer for peer in peers if peer != proc_id]
+        self._seen = set()
+
+    def on_local_message(self, msg, ctx):
+        self._spread(msg['rumor'], ctx)
+
+    def on_message(self, msg, sender, ctx):
+        if msg['rumor'] not in self._seen:
+            self._spread(msg['rumor'], ctx)
+
+    def on_timer(self, timer_name, ctx):
+        ctx.send(Message('RUMOR', {'rumor': timer_name}), random.choice(self._peers))
+
+    def _spread(self, rumor, ctx):
+        self._seen.add(rumor)
+        ctx.send_local(Message('SEEN', {'rumor': rumor, 'time': ctx.time()}))
+        for peer in random.sample(self._peers, 2):
+            ctx.send(Message('RUMOR', {'rumor': rumor}), peer)
+        ctx.set_timer_once(rumor, random.uniform(0.5, 1.5))
+
+
+def _run(seed, **options):
+    sim = Simulation(seed, **options)
+    sim.network.set_delays(0.1, 1)
+    sim.network.set_drop_rate(0.1)
+    sim.network.set_dupl_rate(0.1)
+    ids = [str(i) for i in range(10)]
+    for proc_id in ids:
+        sim.add_process(proc_id, Gossip(proc_id, ids))
+    for i in range(5):
+        sim.send_local_message(ids[i], Message('RUMOR', {'rumor': 'r{}'.format(i)}), delay=i * 0.3)
+    sim.run(until=20)
+    seen = {proc_id: [(msg['rumor'], msg['time']) for msg in sim.read_local_messages(proc_id)] for proc_id in ids}
+    return seen, sim.event_count(), sim.network_message_count()
+
+
+def test_same_seed_same_run():
+    first = _run(7)
+    assert first[1] > 0
+    assert _run(7) == first
+    assert _run(8) != first
+
+
+def test_same_seed_same_run_isolated_random():
+    first = _run(7, isolate_random=True)
+    assert _run(7, isolate_random=True) == first
+    random.seed(1)
+    assert _run(7, isolate_random=True) == first
+
+
+def test_step_by_step_run():
+    sim = Simulation(3)
+    ids = ['a', 'b', 'c']
+    for proc_id in ids:
+        sim.add_process(proc_id, Gossip(proc_id, ids))
+    sim.send_local_message('a', Message('RUMOR', {'rumor': 'x'}))
+    steps = sim.steps(10)
+    assert steps == sim.event_count() == 10
+    sim.run(until=5)
+    assert sim.time() == 5
+    assert all(sim.read_local_messages(proc_id) for proc_id in ids)